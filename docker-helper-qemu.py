@@ -1,19 +1,53 @@
 #!/usr/bin/env python3
 
 import os
+import io
 import sys
 import time
+import json
+import uuid
+import socket
+import atexit
+import asyncio
+import threading
+import selectors
 import subprocess as sp
 import logging
 import re
-
-try:
-    import coloredlogs
-    coloredlogs.install(level=logging.INFO)
-except Exception:
+import shlex
+
+# colours only help on a terminal; skip importing coloredlogs otherwise (e.g. CI)
+if sys.stderr.isatty():
+    try:
+        import coloredlogs
+        coloredlogs.install(level=logging.INFO)
+    except Exception:
+        logging.basicConfig(level=logging.INFO)
+else:
     logging.basicConfig(level=logging.INFO)
 
 
+QMP_SOCK = "/tmp/qmp.{iid}"
+# HMP monitor every FirmAE run.sh exposes; used when QMP was not enabled by -prepare
+HMP_SOCK = "/tmp/qemu.{iid}"
+# static qemu-img shipped in the FirmAE checkout (mounted at /work/FirmAE) for images without qemu-utils
+QEMU_IMG_VENDOR = "/work/FirmAE/vendor/qemu-img"
+# touched after a successful `apt-get update` in the container, so later prepares skip it
+APT_UPDATED_MARKER = "/var/lib/firmae/.apt-updated"
+HMP_PROMPT = b"(qemu) "
+# upper bound (s) for one monitor reply; savevm of a large guest can take a while
+HMP_REPLY_TIMEOUT = 600
+_ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+# docker-helper.py names containers docker<idx>_<firmware with '/', ' ', '.' -> '_'>
+_SANITIZE_TRANS = str.maketrans({'/': '_', ' ': '_', '.': '_'})
+_NAME_RE_FMT = r"^docker\d+_{}$"
+# docker ps listings are reused for this long (seconds) unless a container is started
+PS_CACHE_TTL = 2.0
+_ps_cache = {}
+# firmwares prepared concurrently by `-prepare --firmware-list` (qemu-img convert is I/O heavy)
+PREPARE_CONCURRENCY = 4
+
+
 def sh(cmd, capture=True):
     return sp.run(cmd, capture_output=capture, text=True)
 
@@ -21,242 +55,678 @@ def sh(cmd, capture=True):
 def print_usage(argv0):
     print("[*] Usage (QEMU live snapshots):")
     print(f"  {argv0} -prepare <firmware_path>        # Convert to qcow2 and restart QEMU to support savevm")
-    print(f"  {argv0} -qmsave <firmware_path> <name>  # Save live snapshot via QEMU monitor (no restart)")
-    print(f"  {argv0} -qmload <firmware_path> <name>  # Load snapshot via QEMU monitor (no restart)")
-    print(f"  {argv0} -qmls <firmware_path>           # List snapshots via QEMU monitor")
-    print(f"  {argv0} -qmdel <firmware_path> <name>  # Delete a snapshot via QEMU monitor")
+    print(f"  {argv0} -qmsave <firmware_path> <name>  # Save live snapshot via QMP (no restart)")
+    print(f"  {argv0} -qmload <firmware_path> <name>  # Load snapshot via QMP (no restart)")
+    print(f"  {argv0} -qmls <firmware_path>           # List snapshots via QMP")
+    print(f"  {argv0} -qmdel <firmware_path> <name>  # Delete a snapshot via QMP")
     print("\nNotes:")
     print("- Works with containers started by docker-helper.py. The container must be running.")
-    print("- Requires the VM to use qcow2 (image.qcow2). Use -prepare once per IID to enable.")
+    print("- Requires the VM to use qcow2 (image.qcow2) and expose QMP. Use -prepare once per IID to enable.")
+    print("- qemu-img comes from the container, else ./vendor/qemu-img (static build), else apt (qemu-utils).")
+    print("\n[Global options]\n  --firmware-list                     # <firmware_path> is a file listing one firmware per line\n")
 
 
 def get_container_list(all_containers=False):
+    hit = _ps_cache.get(all_containers)
+    if hit and time.monotonic() - hit[0] < PS_CACHE_TTL:
+        return hit[1]
     cmd = ["docker", "ps", "-a"] if all_containers else ["docker", "ps"]
-    cmd += ["--format", "{{.Names}} {{.Status}}"]
+    # let docker drop unrelated containers; \x1f (unit separator) never occurs in names/statuses
+    cmd += ["--filter", "name=^/?docker[0-9]+_", "--format", "{{.Names}}\x1f{{.Status}}"]
     p = sh(cmd)
     if p.returncode != 0:
         logging.error("[-] docker ps failed: %s", p.stderr.strip())
         return []
-    lines = [l for l in p.stdout.splitlines() if l.strip()]
-    out = []
-    for line in lines:
-        try:
-            name, status = line.split(' ', 1)
-        except ValueError:
-            name, status = line.strip(), ''
-        out.append((name, status))
+    out = [tuple(l.split('\x1f', 1)) for l in p.stdout.split('\n') if l]
+    _ps_cache[all_containers] = (time.monotonic(), out)
     return out
 
 
+def invalidate_container_list():
+    _ps_cache.clear()
+
+
 def find_container_for_firmware(firmware_basename):
-    sanitized = firmware_basename.replace('/', '_').replace(' ', '_').replace('.', '_')
-    pat = re.compile(rf"^docker\d+_{re.escape(sanitized)}$")
-    for name, _ in get_container_list():
-        if pat.match(name):
+    sanitized = firmware_basename.translate(_SANITIZE_TRANS)
+    pat = re.compile(_NAME_RE_FMT.format(re.escape(sanitized)))
+    # single `docker ps -a` pass; running containers report "Up ..." and win over stopped ones
+    stopped = None
+    for name, status in get_container_list(all_containers=True):
+        if not pat.match(name):
+            continue
+        if status.startswith('Up'):
             return name, 'running'
-    for name, _ in get_container_list(all_containers=True):
-        if pat.match(name):
-            return name, 'stopped'
-    return None, None
+        stopped = stopped or name
+    return (stopped, 'stopped') if stopped else (None, None)
+
+
+def wait_until(pred, timeout, initial=0.05, maximum=0.5, factor=2):
+    """Poll pred() with exponential backoff until it is truthy or timeout (s) expires."""
+    deadline = time.monotonic() + timeout
+    delay = initial
+    while True:
+        if pred():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, maximum)
+
+
+def container_running(name):
+    p = sh(["docker", "inspect", "-f", "{{.State.Running}}", name])
+    return p.returncode == 0 and p.stdout.strip() == "true"
+
+
+_pid_cache = {}
+
+
+def container_pid(name):
+    """Host PID of the container's init process (cached), or None."""
+    if name not in _pid_cache:
+        p = sh(["docker", "inspect", "-f", "{{.State.Pid}}", name])
+        pid = p.stdout.strip() if p.returncode == 0 else ""
+        _pid_cache[name] = pid if pid.isdigit() and pid != "0" else None
+    return _pid_cache[name]
 
 
 def ensure_container_running(name, status):
     if status == 'running':
         return True
     p = sh(["docker", "start", name])
-    if p.returncode == 0:
-        time.sleep(2)
-        return True
-    logging.error("[-] Failed to start container %s: %s", name, p.stderr.strip())
-    return False
+    invalidate_container_list()
+    _pid_cache.pop(name, None)
+    if p.returncode != 0:
+        logging.error("[-] Failed to start container %s: %s", name, p.stderr.strip())
+        return False
+    if not wait_until(lambda: container_running(name), timeout=10, initial=0.05, maximum=0.05):
+        logging.error("[-] Container %s did not reach running state", name)
+        return False
+    return True
 
 
-def find_iid(container, firmware_basestem):
-    cmd = [
-        "docker", "exec", container, "bash", "-lc",
-        f"for d in /work/FirmAE/scratch/*; do [ -f \"$d/name\" ] || continue; n=$(cat \"$d/name\"); if [ \"$n\" = \"{firmware_basestem}\" ]; then basename \"$d\"; exit 0; fi; done; exit 1"
-    ]
-    p = sh(cmd)
-    if p.returncode != 0:
-        return None
-    return p.stdout.strip().splitlines()[0]
+class ContainerShell:
+    """A long-lived `docker exec -i <c> bash -l`, so each command costs a pipe write instead of an exec.
 
+    Every command runs in a subshell with stdin from /dev/null and is followed
+    by a sentinel line carrying its exit status. stdout and stderr are merged.
+    """
 
-def docker_exec(container, script):
-    return sh(["docker", "exec", container, "bash", "-lc", script])
+    def __init__(self, container):
+        self.container = container
+        self.token = f"__FIRMAE_END_{uuid.uuid4().hex}__"
+        # unbuffered pipes: commands go out as soon as they are written
+        self.p = sp.Popen(["docker", "exec", "-i", container, "bash", "-l"],
+                          stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.STDOUT, bufsize=0)
+        self.out = io.BufferedReader(self.p.stdout)
+        self.lock = threading.Lock()
+        # swallow whatever the login profile prints before the first command
+        self.run("true")
 
+    def run(self, script):
+        with self.lock:
+            return self._run(script)
 
-def ensure_qcow2_and_restart(container, iid):
-    sd = f"/work/FirmAE/scratch/{iid}"
-    raw = f"{sd}/image.raw"
-    qcow2 = f"{sd}/image.qcow2"
+    def _run(self, script):
+        try:
+            self.p.stdin.write(f"( {script}\n) </dev/null\nprintf '\\n%s %d\\n' {self.token} $?\n".encode())
+        except (BrokenPipeError, ValueError):
+            return sp.CompletedProcess(script, 255, "", "container shell is closed")
+        chunks = []
+        rc = 255
+        while True:
+            line = self.out.readline()
+            if not line:
+                break
+            text = line.decode(errors="replace")
+            if text.startswith(self.token):
+                rc = int(text.split()[1])
+                break
+            chunks.append(text)
+        out = "".join(chunks)
+        # drop the newline printed in front of the sentinel
+        if out.endswith("\n"):
+            out = out[:-1]
+        return sp.CompletedProcess(script, rc, out, out)
+
+    def close(self):
+        if self.p.poll() is None:
+            try:
+                self.p.stdin.close()
+                self.p.wait(timeout=2)
+            except (OSError, sp.TimeoutExpired):
+                self.p.kill()
+
+
+_shells = {}
+_shells_lock = threading.Lock()
+
+
+def container_shell(container):
+    with _shells_lock:
+        sh_ = _shells.get(container)
+        if sh_ is None or sh_.p.poll() is not None:
+            sh_ = _shells[container] = ContainerShell(container)
+        return sh_
+
+
+@atexit.register
+def _close_shells():
+    for sh_ in _shells.values():
+        sh_.close()
+    _shells.clear()
 
-    # Create qcow2 if missing
-    r = docker_exec(container, f"[ -f '{qcow2}' ] || which qemu-img >/dev/null 2>&1 || (apt-get update >/dev/null 2>&1 && apt-get install -y qemu-utils >/dev/null 2>&1) || true")
-    if r.returncode != 0:
-        logging.warning("[!] qemu-img ensure returned: %s", r.stderr.strip())
 
-    p = docker_exec(container, f"[ -f '{qcow2}' ] || qemu-img convert -p -O qcow2 '{raw}' '{qcow2}' && chmod a+rw '{qcow2}'")
-    if p.returncode != 0:
-        logging.error("[-] Failed to convert raw->qcow2: %s", p.stderr.strip())
-        return False
+def docker_exec(container, script):
+    return container_shell(container).run(script)
+
 
-    # Patch scratch run.sh to use qcow2 explicitly (covers existing scripts)
-    patch_cmd = (
-        f"set -e; sd=/work/FirmAE/scratch/{iid}; rs=$sd/run.sh; "
-        # mips: -drive if=ide,format=raw,file=${IMAGE} -> qcow2
-        "sed -i 's@-drive if=ide,format=raw,file=\\${IMAGE}@-drive if=ide,format=qcow2,file=\\${WORK_DIR}/image.qcow2@g' \"$rs\" || true; "
-        # arm: -drive if=none,file=${IMAGE},format=raw,id=rootfs -> qcow2
-        "sed -i 's@-drive if=none,file=\\${IMAGE},format=raw,id=rootfs@-drive if=none,file=\\${WORK_DIR}/image.qcow2,format=qcow2,id=rootfs@g' \"$rs\" || true; "
+_iid_cache = {}
+
+
+def find_iid(container, firmware_basestem):
+    key = (container, firmware_basestem)
+    if key in _iid_cache:
+        return _iid_cache[key]
+    # one fixed-string, whole-line grep over all scratch/*/name files instead of a per-dir loop
+    p = docker_exec(
+        container,
+        f"f=$(grep -lFx -- {shlex.quote(firmware_basestem)} /work/FirmAE/scratch/*/name 2>/dev/null | head -n1) "
+        "&& [ -n \"$f\" ] && basename \"$(dirname \"$f\")\""
     )
-    docker_exec(container, patch_cmd)
+    if p.returncode != 0 or not p.stdout.strip():
+        return None
+    iid = _iid_cache[key] = p.stdout.strip().splitlines()[0]
+    return iid
+
+
+def wait_for_socket(container, path, timeout):
+    """Block on inotify until `path` is created in the container.
+
+    Returns True/False, or None when inotifywait is unavailable. The existence
+    check runs only after the watch is established, so a socket created in
+    between is not missed.
+    """
+    d, f = os.path.split(path)
+    script = f"""
+command -v inotifywait >/dev/null 2>&1 || exit 2
+rc=1
+while read -r f; do
+    case "$f" in
+        "Watches established.") [ -S {shlex.quote(path)} ] && {{ rc=0; break; }} ;;
+        {shlex.quote(f)}) rc=0; break ;;
+    esac
+done < <(exec timeout {int(timeout)} inotifywait -m -e create --format %f {shlex.quote(d)} 2>&1)
+kill $! 2>/dev/null
+exit $rc
+"""
+    r = docker_exec(container, script)
+    if r.returncode == 2:
+        return None
+    return r.returncode == 0
 
-    # Restart QEMU to pick qcow2
-    docker_exec(container, "pkill -f qemu-system || true")
-    time.sleep(1)
-    # ensure working directory is /work/FirmAE so relative paths in scripts resolve
-    p = docker_exec(container, f"cd /work/FirmAE && nohup ./scratch/{iid}/run.sh >./scratch/{iid}/qemu.relaunch.log 2>&1 & disown")
+
+def ensure_qcow2_and_restart(container, iid):
+    # One shell round-trip: ensure qemu-img, convert raw->qcow2, patch run.sh, relaunch QEMU
+    script = rf"""
+set -e
+sd=/work/FirmAE/scratch/{iid}
+rs=$sd/run.sh
+if [ ! -f "$sd/image.qcow2" ]; then
+    # qemu-img from the image, else a static one dropped into the FirmAE checkout (bind-mounted),
+    # else apt; `apt-get update` (network-bound) runs at most once per container
+    qemu_img=$(command -v qemu-img || true)
+    [ -n "$qemu_img" ] || [ ! -x {QEMU_IMG_VENDOR} ] || qemu_img={QEMU_IMG_VENDOR}
+    if [ -z "$qemu_img" ]; then
+        [ -f {APT_UPDATED_MARKER} ] || {{ apt-get update >/dev/null 2>&1 && mkdir -p /var/lib/firmae && touch {APT_UPDATED_MARKER}; }} || true
+        apt-get install -y qemu-utils >/dev/null 2>&1 || true
+        qemu_img=$(command -v qemu-img || echo qemu-img)
+    fi
+    # 8 coroutines with out-of-order writes (target is fresh); 1M clusters, lazy refcounts and
+    # preallocated metadata keep later savevm/COW overhead low
+    "$qemu_img" convert -p -W -m 8 -O qcow2 -o cluster_size=1M,lazy_refcounts=on,preallocation=metadata \
+        "$sd/image.raw" "$sd/image.qcow2" || {{ echo "[-] Failed to convert raw->qcow2" >&2; exit 2; }}
+fi
+chmod a+rw "$sd/image.qcow2"
+
+# Patch scratch run.sh to use qcow2 explicitly (covers existing scripts) and expose QMP
+# mips: -drive if=ide,format=raw,file=${{IMAGE}} -> qcow2
+# arm: -drive if=none,file=${{IMAGE}},format=raw,id=rootfs -> qcow2
+sed -i \
+    -e 's@-drive if=ide,format=raw,file=\${{IMAGE}}@-drive if=ide,format=qcow2,file=\${{WORK_DIR}}/image.qcow2@g' \
+    -e 's@-drive if=none,file=\${{IMAGE}},format=raw,id=rootfs@-drive if=none,file=\${{WORK_DIR}}/image.qcow2,format=qcow2,id=rootfs@g' \
+    "$rs" || true
+# QMP socket next to the HMP monitor: -qmp unix:/tmp/qmp.${{IID}},server,nowait
+grep -q -- '-qmp unix:/tmp/qmp' "$rs" || sed -i 's@-monitor unix:/tmp/qemu.\${{IID}},server,nowait@& -qmp unix:/tmp/qmp.\${{IID}},server,nowait@' "$rs" || true
+
+# Restart QEMU to pick qcow2: SIGTERM, wait up to 2s for it to exit, then SIGKILL leftovers
+pkill -f qemu-system || true
+for _ in $(seq 20); do
+    pgrep -f qemu-system >/dev/null || break
+    sleep 0.1
+done
+pkill -9 -f qemu-system || true
+# ensure working directory is /work/FirmAE so relative paths in scripts resolve
+cd /work/FirmAE
+# own session under a tini subreaper so exited QEMU children are reaped across prepares
+reaper=$(command -v tini || true)
+setsid ${{reaper:+$reaper -s --}} ./scratch/{iid}/run.sh >./scratch/{iid}/qemu.relaunch.log 2>&1 </dev/null &
+disown
+"""
+    p = docker_exec(container, script)
     if p.returncode != 0:
-        logging.error("[-] Failed to relaunch QEMU: %s", p.stderr.strip())
+        logging.error("[-] Failed to prepare qcow2 and relaunch QEMU: %s", p.stderr.strip())
         return False
 
-    # wait monitor (up to 180s, firmware may take time to boot to start QEMU)
-    for _ in range(180):
-        ok = docker_exec(container, f"[ -S '/tmp/qemu.{iid}' ] && echo ok || true")
-        if ok.returncode == 0 and 'ok' in ok.stdout:
-            return True
-        time.sleep(1)
+    # wait QMP socket (up to 180s, firmware may take time to boot to start QEMU)
+    qmp_sock = QMP_SOCK.format(iid=iid)
+    ready = wait_for_socket(container, qmp_sock, timeout=180)
+    if ready is None:
+        # no inotifywait in the container: poll with backoff
+        def qmp_ready():
+            ok = docker_exec(container, f"[ -S '{qmp_sock}' ] && echo ok || true")
+            return ok.returncode == 0 and 'ok' in ok.stdout
+
+        ready = wait_until(qmp_ready, timeout=180, initial=0.025, maximum=0.5)
+    if ready:
+        return True
     # show last lines of relaunch log to help diagnose
     log_tail = docker_exec(container, f"tail -n 80 /work/FirmAE/scratch/{iid}/qemu.relaunch.log || true")
     if log_tail.stdout:
         sys.stderr.write(log_tail.stdout)
-    logging.error("[-] QEMU monitor socket not ready: /tmp/qemu.%s", iid)
+    logging.error("[-] QMP socket not ready: %s", qmp_sock)
     return False
 
 
-def hmp(container, iid, commands):
-    if isinstance(commands, (list, tuple)):
-        payload = "\n".join(commands) + "\n"
-    else:
-        payload = str(commands).rstrip("\n") + "\n"
-    cmd = ["docker", "exec", "-i", container, "socat", "-", f"UNIX-CONNECT:/tmp/qemu.{iid}"]
-    return sp.run(cmd, input=payload, text=True, capture_output=True)
+class QmpClient:
+    """One QMP session to the VM of an IID, kept open for the whole CLI invocation.
+
+    QMP replies are newline-framed JSON objects, so a command is complete as
+    soon as its "return"/"error" line arrives; no silence timeout is needed, only
+    an upper bound of HMP_REPLY_TIMEOUT per reply (e.g. while another client holds
+    the monitor).
+    Transports, first that connects wins: the UNIX socket opened from the
+    host through /proc/<pid>/root (needs root), then docker exec + socat.
+    """
+
+    # speaks native QMP commands such as query-block
+    structured = True
+
+    def __init__(self, container, iid):
+        self.container = container
+        self.iid = iid
+        self.proc = None
+        self.sock = None
+        self.sel = None
+        self.wfile = None
+        self.buf = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connect_host_unix(self):
+        pid = container_pid(self.container)
+        if not pid:
+            return False
+        # the container's /tmp as seen from the host, via the QEMU container's root
+        path = f"/proc/{pid}/root{QMP_SOCK.format(iid=self.iid)}"
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError as e:
+            logging.debug("[*] QMP via %s unavailable: %s", path, e)
+            sock.close()
+            return False
+        self.sock = sock
+        self.wfile = self.sock.makefile("wb")
+        return True
 
+    def _connect_exec(self):
+        cmd = ["docker", "exec", "-i", self.container,
+               "socat", "-t", "0.05", "-", f"UNIX-CONNECT:{QMP_SOCK.format(iid=self.iid)}"]
+        self.proc = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.DEVNULL)
+        self.wfile = self.proc.stdin
+
+    def connect(self):
+        if not self._connect_host_unix():
+            self._connect_exec()
+        # one selector over either transport, so every reply wait is bounded
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.sock if self.sock is not None else self.proc.stdout, selectors.EVENT_READ)
+        try:
+            greeting = self._recv()
+        except TimeoutError:
+            greeting = None
+        if not greeting or "QMP" not in greeting:
+            logging.error("[-] No QMP greeting from /tmp/qmp.%s", self.iid)
+            self.close()
+            return False
+        r = self.execute("qmp_capabilities")
+        if "error" in r:
+            logging.error("[-] qmp_capabilities failed: %s", r["error"].get("desc"))
+            self.close()
+            return False
+        return True
 
-def qmsave(container, iid, name):
-    # stop; savevm; cont keeps VM consistent
-    r = hmp(container, iid, ["stop", f"savevm {name}", "cont", "info snapshots"])
-    if r.returncode != 0:
-        logging.error("[-] savevm failed: %s", r.stderr.strip())
+    def _recv(self, timeout=HMP_REPLY_TIMEOUT):
+        """Next JSON line, None on EOF; raises TimeoutError when nothing completes a line in time."""
+        deadline = time.monotonic() + timeout
+        while b"\n" not in self.buf:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.sel.select(remaining):
+                raise TimeoutError
+            src = self.sock if self.sock is not None else self.proc.stdout
+            chunk = os.read(src.fileno(), 65536)
+            if not chunk:
+                return None
+            self.buf += chunk
+        line, _, rest = bytes(self.buf).partition(b"\n")
+        self.buf = bytearray(rest)
+        try:
+            return json.loads(line)
+        except ValueError:
+            return {}
+
+    def execute(self, command, arguments=None):
+        req = {"execute": command}
+        if arguments:
+            req["arguments"] = arguments
+        try:
+            self.wfile.write(json.dumps(req).encode() + b"\n")
+            self.wfile.flush()
+        except (OSError, AttributeError):
+            return {"error": {"class": "GenericError", "desc": "QMP connection is closed"}}
+        while True:
+            try:
+                msg = self._recv()
+            except TimeoutError:
+                # the stream is out of step now, so this session cannot be reused
+                self.close()
+                return {"error": {"class": "GenericError",
+                                  "desc": f"no QMP reply to {command} within {HMP_REPLY_TIMEOUT}s"}}
+            if msg is None:
+                return {"error": {"class": "GenericError", "desc": "QMP connection closed"}}
+            # skip asynchronous events (STOP, RESUME, ...)
+            if "return" in msg or "error" in msg:
+                return msg
+
+    def hmp(self, command_line):
+        return self.execute("human-monitor-command", {"command-line": command_line})
+
+    def close(self):
+        if self.sel is not None:
+            self.sel.close()
+            self.sel = None
+        if self.sock is not None:
+            for f in (self.wfile, self.sock):
+                f.close()
+            self.sock = None
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=1)
+            except (sp.TimeoutExpired, OSError):
+                self.proc.kill()
+            self.proc = None
+        self.wfile = None
+        self.buf = bytearray()
+
+
+class HmpClient:
+    """Fallback with QmpClient's hmp()/close() interface, speaking HMP on /tmp/qemu.<iid>.
+
+    A reply is complete once the next `(qemu) ` prompt arrives, so nothing waits
+    for socat's EOF/silence timeout. `quit` is never sent: on HMP it stops QEMU.
+    """
+
+    # HMP command lines only
+    structured = False
+
+    def __init__(self, container, iid):
+        self.container = container
+        self.iid = iid
+        self.proc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        # -t 0.05: once stdin closes, socat lingers 50ms instead of 500ms
+        cmd = ["docker", "exec", "-i", self.container,
+               "socat", "-t", "0.05", "-", f"UNIX-CONNECT:{HMP_SOCK.format(iid=self.iid)}"]
+        self.proc = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.DEVNULL, bufsize=0)
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.proc.stdout, selectors.EVENT_READ)
+        self.buf = bytearray()
+        # banner: "QEMU x.y monitor - type 'help' for more information\n(qemu) "
+        if self._read_prompts(1) is None:
+            logging.error("[-] No HMP prompt from %s", HMP_SOCK.format(iid=self.iid))
+            self.close()
+            return False
+        return True
+
+    def _read_prompts(self, n, timeout=HMP_REPLY_TIMEOUT):
+        """Read as data arrives until n more prompts were seen; returns the n outputs before them."""
+        deadline = time.monotonic() + timeout
+        while self.buf.count(HMP_PROMPT) < n:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.sel.select(remaining):
+                return None
+            chunk = os.read(self.proc.stdout.fileno(), 65536)
+            if not chunk:
+                return None
+            self.buf += chunk
+        parts = bytes(self.buf).split(HMP_PROMPT, n)
+        self.buf = bytearray(parts[n])
+        return parts[:n]
+
+    def hmp(self, command_line):
+        try:
+            self.proc.stdin.write(command_line.encode() + b"\n")
+        except (BrokenPipeError, AttributeError):
+            return {"error": {"class": "GenericError", "desc": "HMP connection is closed"}}
+        outs = self._read_prompts(1)
+        if outs is None:
+            return {"error": {"class": "GenericError", "desc": "HMP connection closed or timed out"}}
+        text = _ANSI_RE.sub("", outs[0].decode(errors="replace")).replace("\r", "")
+        # first line is the monitor's echo of the command
+        return {"return": text.split("\n", 1)[1] if "\n" in text else ""}
+
+    def close(self):
+        if self.proc is None:
+            return
+        self.sel.close()
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=1)
+        except sp.TimeoutExpired:
+            self.proc.kill()
+        self.proc = None
+
+
+def monitor_client(container, iid):
+    """QmpClient when -prepare exposed QMP, otherwise HmpClient on the stock monitor, else None."""
+    r = docker_exec(container, f"for s in '{QMP_SOCK.format(iid=iid)}' '{HMP_SOCK.format(iid=iid)}'; do [ -S \"$s\" ] && echo \"$s\" && break; done; true")
+    found = r.stdout.strip() if r.returncode == 0 else ""
+    if found == QMP_SOCK.format(iid=iid):
+        return QmpClient(container, iid)
+    if found == HMP_SOCK.format(iid=iid):
+        logging.warning("[!] QMP not enabled for IID %s, falling back to the HMP monitor (run -prepare to enable QMP)", iid)
+        return HmpClient(container, iid)
+    return None
+
+
+def qmp_error(r):
+    """Error text of a monitor reply, or None on success.
+
+    human-monitor-command (and HMP) report savevm/loadvm/delvm failures only in
+    the returned text, e.g. "Error: Device 'ide0-hd0' is writable but does not
+    support snapshots", so such lines count as errors too.
+    """
+    if "error" in r:
+        return r["error"].get("desc", "unknown error")
+    ret = r.get("return")
+    if isinstance(ret, str):
+        failed = [l.strip() for l in ret.splitlines()
+                  if l.startswith("Error") or "does not support snapshots" in l]
+        if failed:
+            return "; ".join(failed)
+    return None
+
+
+def qmsave(qmp, name):
+    # savevm pauses and resumes a running VM itself, so no separate stop/cont round-trips
+    r = qmp.hmp(f"savevm {name}")
+    if qmp_error(r):
+        logging.error("[-] savevm failed: %s", qmp_error(r))
         return False
-    logging.info(r.stdout.rstrip())
-    if "{name}" in r.stdout:
-        logging.info("[+] Saved snapshot '%s'", name)
+    logging.info("[+] Saved snapshot '%s'", name)
     return True
 
 
-def qmload(container, iid, name):
-    r = hmp(container, iid, ["stop", f"loadvm {name}", "cont"])
-    if r.returncode != 0:
-        logging.error("[-] loadvm failed: %s", r.stderr.strip())
+def qmload(qmp, name):
+    # likewise loadvm stops the VM and restarts it if it was running
+    r = qmp.hmp(f"loadvm {name}")
+    if qmp_error(r):
+        logging.error("[-] loadvm failed: %s", qmp_error(r))
         return False
     logging.info("[+] Loaded snapshot '%s'", name)
     return True
 
 
-def qmls(container, iid):
-    r = hmp(container, iid, ["info snapshots"])
-    if r.returncode != 0:
-        logging.error("[-] list snapshots failed: %s", r.stderr.strip())
+def _fmt_snapshot(dev, snap):
+    date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snap.get("date-sec", 0)))
+    clock_ns = snap.get("vm-clock-sec", 0) * 10**9 + snap.get("vm-clock-nsec", 0)
+    secs, ms = divmod(clock_ns // 10**6, 1000)
+    clock = f"{secs // 3600:02d}:{secs // 60 % 60:02d}:{secs % 60:02d}.{ms:03d}"
+    return f"{dev:<12} {snap.get('id', ''):<4} {snap.get('name', ''):<24} {snap.get('vm-state-size', 0):>12} {date} {clock}"
+
+
+def qmls(qmp):
+    if not qmp.structured:
+        r = qmp.hmp("info snapshots")
+        if qmp_error(r):
+            logging.error("[-] list snapshots failed: %s", qmp_error(r))
+            return False
+        print(r["return"].rstrip())
+        return True
+    # internal snapshots straight from the qcow2 image info, no HMP text to scrape
+    r = qmp.execute("query-block")
+    if qmp_error(r):
+        logging.error("[-] list snapshots failed: %s", qmp_error(r))
         return False
-    print(r.stdout.rstrip())
+    print(f"{'DEVICE':<12} {'ID':<4} {'TAG':<24} {'VM SIZE':>12} {'DATE':<19} VM CLOCK")
+    for blk in r["return"]:
+        image = blk.get("inserted", {}).get("image", {})
+        for snap in image.get("snapshots", []):
+            print(_fmt_snapshot(blk.get("device") or blk.get("qdev", ""), snap))
     return True
 
 
-def qmdel(container, iid, name):
-    r = hmp(container, iid, [f"delvm {name}", "info snapshots"])
-    if r.returncode != 0:
-        logging.error("[-] delete snapshot failed: %s", r.stderr.strip())
+def qmdel(qmp, name):
+    r = qmp.hmp(f"delvm {name}")
+    if qmp_error(r):
+        logging.error("[-] delete snapshot failed: %s", qmp_error(r))
         return False
     logging.info("[+] Deleted snapshot '%s'", name)
     return True
 
 
-def main():
-    if len(sys.argv) < 3:
-        print_usage(sys.argv[0])
-        sys.exit(1)
-
-    mode = sys.argv[1]
-    fw = os.path.abspath(sys.argv[2])
-    if not os.path.isabs(fw):
-        fw = os.path.abspath(fw)
+def handle_firmware(mode, fw, snapshot):
     fw_base = os.path.basename(fw)
-    stem = fw_base.rsplit('.', 1)[0]
+    stem = os.path.splitext(fw_base)[0]
 
     container, status = find_container_for_firmware(fw_base)
     if not container:
         logging.error("[-] No container found for firmware: %s", fw_base)
-        sys.exit(1)
+        return False
     if not ensure_container_running(container, status):
-        sys.exit(1)
+        return False
 
     iid = find_iid(container, stem)
     if not iid:
         logging.error("[-] Could not find IID for firmware base '%s' in %s", stem, container)
-        sys.exit(1)
+        return False
     logging.info("[*] Target container=%s IID=%s", container, iid)
 
     if mode == '-prepare':
         if not ensure_qcow2_and_restart(container, iid):
-            sys.exit(1)
+            return False
         # probe savevm support
-        r = hmp(container, iid, ["info snapshots"])  # after restart with qcow2
-        if r.returncode == 0:
-            print(r.stdout.rstrip())
-        logging.info("[+] Prepared qcow2 and monitor for live snapshots")
-        return
-
-    # ensure monitor exists
-    mon = docker_exec(container, f"[ -S '/tmp/qemu.{iid}' ] && echo ok || true")
-    if mon.returncode != 0 or 'ok' not in mon.stdout:
+        client = monitor_client(container, iid)
+        if client is not None:
+            with client as qmp:
+                if qmp.connect():  # after restart with qcow2
+                    qmls(qmp)
+        logging.info("[+] Prepared qcow2 and QMP for live snapshots")
+        return True
+
+    # ensure a monitor socket exists
+    client = monitor_client(container, iid)
+    if client is None:
         logging.error("[-] QEMU monitor not found. Run '-prepare' first or ensure firmware is running.")
+        return False
+
+    with client as qmp:
+        if not qmp.connect():
+            return False
+        if mode == '-qmsave':
+            return qmsave(qmp, snapshot)
+        if mode == '-qmload':
+            return qmload(qmp, snapshot)
+        if mode == '-qmls':
+            return qmls(qmp)
+        return qmdel(qmp, snapshot)
+
+
+async def prepare_many(firmwares, limit=PREPARE_CONCURRENCY):
+    """Prepare several firmwares (one container each) concurrently, at most `limit` at a time."""
+    sem = asyncio.Semaphore(limit)
+
+    async def one(fw):
+        async with sem:
+            return await asyncio.to_thread(handle_firmware, '-prepare', fw, None)
+
+    return await asyncio.gather(*(one(fw) for fw in firmwares))
+
+
+def main():
+    firmware_list = '--firmware-list' in sys.argv
+    argv = [a for a in sys.argv if a != '--firmware-list']
+    if len(argv) < 3:
+        print_usage(argv[0])
+        sys.exit(1)
+
+    mode = argv[1]
+    if mode not in ('-prepare', '-qmsave', '-qmload', '-qmls', '-qmdel'):
+        print_usage(argv[0])
         sys.exit(1)
+    if mode in ('-qmsave', '-qmload', '-qmdel') and len(argv) < 4:
+        print_usage(argv[0])
+        sys.exit(1)
+    snapshot = argv[3] if len(argv) >= 4 else None
+
+    fw = os.path.abspath(argv[2])
+    if firmware_list:
+        with open(fw) as f:
+            firmwares = [l.strip() for l in f if l.strip() and not l.startswith('#')]
+    else:
+        firmwares = [fw]
 
-    if mode == '-qmsave':
-        if len(sys.argv) < 4:
-            print_usage(sys.argv[0])
-            sys.exit(1)
-        name = sys.argv[3]
-        if not qmsave(container, iid, name):
-            sys.exit(1)
-        return
-
-    if mode == '-qmload':
-        if len(sys.argv) < 4:
-            print_usage(sys.argv[0])
-            sys.exit(1)
-        name = sys.argv[3]
-        if not qmload(container, iid, name):
-            sys.exit(1)
-        return
-
-    if mode == '-qmls':
-        if not qmls(container, iid):
-            sys.exit(1)
-        return
-
-    if mode == '-qmdel':
-        if len(sys.argv) < 4:
-            print_usage(sys.argv[0])
-            sys.exit(1)
-        name = sys.argv[3]
-        if not qmdel(container, iid, name):
-            sys.exit(1)
-        return
-
-    print_usage(sys.argv[0])
-    sys.exit(1)
+    if mode == '-prepare' and len(firmwares) > 1:
+        results = asyncio.run(prepare_many(firmwares))
+    else:
+        # the docker ps listing is cached, so N firmwares share one lookup
+        results = [handle_firmware(mode, f, snapshot) for f in firmwares]
+    if not all(results):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
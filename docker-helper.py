@@ -2,17 +2,431 @@
 
 import sys
 import threading
+import asyncio
 import subprocess as sp
 import time
 import os
 import signal
+import re
+import json
+import socket
+import http.client
+import urllib.parse
+import io
+import uuid
+import shlex
+import tarfile
+import hashlib
 import scripts.util as util
 import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import logging, coloredlogs
 
-# 设置日志
-coloredlogs.install(level=logging.DEBUG)
-coloredlogs.install(level=logging.INFO)
+# 设置日志（只安装一次；可用 FIRMAE_LOG_LEVEL=DEBUG 打开调试输出）
+coloredlogs.install(level=os.environ.get('FIRMAE_LOG_LEVEL', 'INFO').upper())
+
+DOCKER_SOCK = "/var/run/docker.sock"
+
+# 预热池中空闲容器的名称前缀
+POOL_PREFIX = "fcore_pool_"
+# 预热容器上记录 docker run 配置摘要的标签，认领时只匹配相同配置
+POOL_CONFIG_LABEL = "firmae.config"
+
+# 容器名中需要替换为 '_' 的字符（模块加载时建表一次，str.translate 单次遍历完成替换）
+_SANITIZE_TABLE = str.maketrans({'/': '_', ' ': '_', '.': '_'})
+
+
+def _sanitize(name):
+    return name.translate(_SANITIZE_TABLE)
+
+
+@lru_cache(maxsize=256)
+def _container_pattern(sanitized):
+    """匹配 docker<number>_<sanitized_firmware> 的正则（按固件名缓存）"""
+    return re.compile(rf"^docker\d+_{re.escape(sanitized)}$")
+
+
+def _status_to_state(status):
+    """把 docker ps 的 Status 列（"Up 2 hours (Paused)"、"Exited (0) ..."）转换为容器状态"""
+    if status.startswith('Up'):
+        return "paused" if "(Paused)" in status else "running"
+    if status.startswith('Created'):
+        return "created"
+    return "exited"
+
+
+# 端口映射配置：(容器端口, 固件端口, 服务名)
+PORT_MAPPINGS = [
+    (8080, 80, "HTTP"),
+    (8443, 443, "HTTPS"),
+    (2323, 23, "Telnet"),
+    (2222, 22, "SSH"),
+    (11337, 1337, "GDB"),
+]
+
+# 容器内 PostgreSQL 初始化
+POSTGRES_INIT = (
+    "service postgresql start && sleep 2 && sudo -u postgres createdb firmware || true && "
+    "sudo -u postgres psql -d firmware -c \"CREATE EXTENSION IF NOT EXISTS pgcrypto;\" || true"
+)
+
+
+def _port_forward_script(kernel_nat=True):
+    """容器内一次完成全部端口转发的 bash 脚本，每个服务输出一行 "SVC running|started"。
+    kernel_nat=True 时优先用内核 DNAT（iptables），数据不经过用户态拷贝；没有 iptables 时退回 socat。
+    --net=host 下容器与宿主机共用 nat 表，调用方必须传 kernel_nat=False，只用 socat。
+    DNAT 只匹配目的地址是本机地址的流量（-m addrtype --dst-type LOCAL），不劫持经过容器转发到别处的 8080 等端口；
+    OUTPUT 链上的同样规则让容器内访问 127.0.0.1:8080 等也能转发，为此需要 route_localnet。
+    fcore 镜像已内置 socat/procps/iptables，只有旧镜像才会走到 apt-get 安装分支"""
+    socat = (
+        "    command -v socat >/dev/null 2>&1 || "
+        "{ echo installing; apt-get update > /dev/null 2>&1 && apt-get install -y socat > /dev/null 2>&1; }\n"
+        "    for m in $MAPS; do\n"
+        "        L=${m%%:*}; rest=${m#*:}; T=${rest%%:*}; S=${rest#*:}\n"
+        "        if pgrep -f \"socat TCP-LISTEN:$L,\" >/dev/null; then echo \"$S running\"; continue; fi\n"
+        "        setsid socat TCP-LISTEN:$L,fork,reuseaddr TCP:192.168.0.1:$T </dev/null >/dev/null 2>&1 &\n"
+        "        echo \"$S started\"\n"
+        "    done\n"
+    )
+    script = "MAPS='" + " ".join("{}:{}:{}".format(l, t, svc) for l, t, svc in PORT_MAPPINGS) + "'\n"
+    if not kernel_nat:
+        return script + socat
+    return script + (
+        "if command -v iptables >/dev/null 2>&1; then\n"
+        "    sysctl -qw net.ipv4.ip_forward=1 net.ipv4.conf.all.route_localnet=1\n"
+        "    iptables -t nat -C POSTROUTING -d 192.168.0.1 -j MASQUERADE 2>/dev/null || "
+        "iptables -t nat -A POSTROUTING -d 192.168.0.1 -j MASQUERADE\n"
+        "    for m in $MAPS; do\n"
+        "        L=${m%%:*}; rest=${m#*:}; T=${rest%%:*}; S=${rest#*:}\n"
+        "        rule=\"-p tcp -m addrtype --dst-type LOCAL --dport $L -j DNAT --to-destination 192.168.0.1:$T\"\n"
+        "        iptables -t nat -C OUTPUT $rule 2>/dev/null || iptables -t nat -A OUTPUT $rule\n"
+        "        if iptables -t nat -C PREROUTING $rule 2>/dev/null; then echo \"$S running\"; continue; fi\n"
+        "        iptables -t nat -A PREROUTING $rule && echo \"$S started\"\n"
+        "    done\n"
+        "else\n"
+    ) + socat + "fi\n"
+
+
+# -reset 使用的镜像还原脚本：第一次还原时把 image.raw 保存为 image.clean 基线，之后从基线拷回。
+# 脚本按内容哈希命名后上传到 SCRIPT_DIR，调用它的那次 exec 先检查文件是否存在，缺失时以 SCRIPT_MISSING 退出，
+# 调用方上传后再重试；文件留在容器里，所以每个容器（及每版脚本内容）只上传一次，跨进程同样成立。
+# 固件镜像位于 /work/FirmAE/scratch，是宿主机目录的 bind mount，docker commit / checkpoint 不会包含它，
+# 所以不能靠“从提交的镜像重建容器”来还原；这里用 --reflink 拷贝，在支持 CoW 的文件系统上同样只是元数据操作
+SCRIPT_DIR = "/usr/local/bin"
+CLEAN_SCRIPT = "firmae_clean.sh"
+CLEAN_SCRIPT_BODY = """#!/bin/sh
+set -e
+sd=/work/FirmAE/scratch/$1
+[ -f "$sd/image.clean" ] || cp --reflink=auto --sparse=always "$sd/image.raw" "$sd/image.clean"
+cp --reflink=auto --sparse=always "$sd/image.clean" "$sd/image.raw"
+"""
+# 容器内脚本尚未上传时，调用它的 exec 的退出码
+SCRIPT_MISSING = 97
+
+
+def _script_name(name, body):
+    """脚本在容器中的文件名：带内容哈希，脚本改动后不会误用旧文件"""
+    stem, ext = os.path.splitext(name)
+    return "{}.{}{}".format(stem, hashlib.sha1(body.encode()).hexdigest()[:12], ext)
+
+
+def _script_path(name, body):
+    return "{}/{}".format(SCRIPT_DIR, _script_name(name, body))
+
+
+@lru_cache(maxsize=None)
+def _script_tar(name, body):
+    """把单个可执行脚本打成内存中的 tar 归档（按内容缓存），归档内文件名为 _script_name()"""
+    data = body.encode()
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        info = tarfile.TarInfo(_script_name(name, body))
+        info.size = len(data)
+        info.mode = 0o755
+        tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _wait(pred, timeout=30, initial=0.05, maximum=2.0, factor=1.5):
+    """指数退避轮询 pred()，直到返回真或超时；返回最后一次 pred() 的结果"""
+    deadline = time.monotonic() + timeout
+    delay = initial
+    while True:
+        ok = pred()
+        if ok or time.monotonic() >= deadline:
+            return ok
+        time.sleep(min(delay, max(0, deadline - time.monotonic())))
+        delay = min(delay * factor, maximum)
+
+
+class unix_http_connection(http.client.HTTPConnection):
+    """通过 UNIX socket 访问 Docker Engine API"""
+    def __init__(self, path=DOCKER_SOCK, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+# Docker API 调用可能出现的异常（socket 不存在/无权限、连接被关闭、JSON 解析失败）
+_API_ERRORS = (OSError, ValueError, http.client.HTTPException)
+
+
+class docker_api:
+    """复用一条 UNIX socket 连接调用 Docker Engine API，省去每次 fork docker CLI"""
+    def __init__(self, sock_path=DOCKER_SOCK, timeout=30):
+        self.sock_path = sock_path
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def request(self, method, path, body=None):
+        """返回 (status, body)，body 为解析后的 JSON（无内容时为 None）；请求体为 bytes 时按 tar 归档发送。
+        失败时抛出 _API_ERRORS 中的异常"""
+        headers = {}
+        if isinstance(body, bytes):
+            headers["Content-Type"] = "application/x-tar"
+        elif body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        with self._lock:
+            for attempt in range(2):
+                if self._conn is None:
+                    self._conn = unix_http_connection(self.sock_path, timeout=self.timeout)
+                try:
+                    self._conn.request(method, path, body, headers)
+                    resp = self._conn.getresponse()
+                    data = resp.read()
+                    break
+                except (OSError, http.client.HTTPException):
+                    # dockerd 关闭了空闲连接：重连一次
+                    self._conn.close()
+                    self._conn = None
+                    if attempt:
+                        raise
+        return resp.status, (json.loads(data) if data else None)
+
+    def put_archive(self, container, path, data):
+        """把 tar 归档解压到容器内的 path 目录"""
+        status, body = self.request("PUT", "/containers/{}/archive?path={}".format(
+            urllib.parse.quote(container), urllib.parse.quote(path)), data)
+        if status != 200:
+            raise OSError("put archive into {}: {}".format(container, (body or {}).get("message", status)))
+
+    def _exec_create(self, container, cmd, attach=True, stdout=True, stdin=False):
+        status, body = self.request("POST", "/containers/{}/exec".format(urllib.parse.quote(container)),
+                                    {"Cmd": cmd, "AttachStdin": stdin, "AttachStdout": attach and stdout,
+                                     "AttachStderr": attach})
+        if status != 201:
+            raise OSError("exec in {}: {}".format(container, (body or {}).get("message", status)))
+        return body["Id"]
+
+    def _exec_start(self, exec_id, detach=False):
+        # exec/start 会劫持连接并一直输出到命令结束，不能复用长连接，也不设读超时
+        conn = unix_http_connection(self.sock_path)
+        conn.request("POST", "/exec/{}/start".format(exec_id), json.dumps({"Detach": detach, "Tty": False}),
+                     {"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        if resp.status != 200:
+            message = resp.read().decode('utf-8', 'replace')
+            conn.close()
+            raise OSError("exec start: {}".format(message))
+        return conn, resp
+
+    @staticmethod
+    def _frames(resp):
+        """逐帧读取非 TTY 输出：1 字节流类型（1=stdout, 2=stderr）+ 3 字节填充 + 4 字节大端长度"""
+        while True:
+            header = resp.read(8)
+            if len(header) < 8:
+                return
+            yield header[0], resp.read(int.from_bytes(header[4:], "big"))
+
+    def exec_run(self, container, cmd, detach=False, stdout=True):
+        """在容器中执行 cmd（argv 列表），返回 (exit_code, stdout, stderr)，输出为 bytes；stdout=False 时不接收 stdout。
+        detach=True 时由 dockerd 直接在后台启动进程，不等待，返回 (0, b"", b"")"""
+        exec_id = self._exec_create(container, cmd, attach=not detach, stdout=stdout)
+        conn, resp = self._exec_start(exec_id, detach)
+        out, err = [], []
+        try:
+            if detach:
+                return 0, b"", b""
+            for stream, data in self._frames(resp):
+                (err if stream == 2 else out).append(data)
+        finally:
+            conn.close()
+
+        status, body = self.request("GET", "/exec/{}/json".format(exec_id))
+        code = body.get("ExitCode") if status == 200 else None
+        return (-1 if code is None else code), b"".join(out), b"".join(err)
+
+    def exec_stream(self, container, cmd):
+        """在容器中执行 cmd，随输出到达逐帧产出 (stream, bytes)"""
+        conn, resp = self._exec_start(self._exec_create(container, cmd))
+        try:
+            yield from self._frames(resp)
+        finally:
+            conn.close()
+
+
+class exec_session:
+    """容器内常驻的 bash：只创建一次 exec，之后每条命令只是往劫持的 API 连接里写一次，省去逐条 exec 的开销。
+    命令在子 shell 中执行（stdin 为 /dev/null），之后在 stdout/stderr 上各输出一行带退出码的哨兵"""
+    def __init__(self, api, container):
+        self.token = "__FIRMAE_END_{}__".format(uuid.uuid4().hex).encode()
+        exec_id = api._exec_create(container, ["bash"], stdin=True)
+        body = json.dumps({"Detach": False, "Tty": False}).encode()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(api.sock_path)
+        self.sock.sendall(
+            "POST /exec/{}/start HTTP/1.1\r\nHost: localhost\r\nConnection: Upgrade\r\nUpgrade: tcp\r\n"
+            "Content-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(exec_id, len(body)).encode() + body)
+        self.f = self.sock.makefile("rb")
+        status = self.f.readline().split()
+        if len(status) < 2 or status[1] not in (b"101", b"200"):
+            self.close()
+            raise OSError("exec session start in {}: {}".format(container, b" ".join(status[1:]).decode()))
+        while self.f.readline() not in (b"\r\n", b"\n", b""):
+            pass
+        self.frames = docker_api._frames(self.f)
+        self.lock = threading.Lock()
+
+    def run(self, script):
+        """执行 shell 脚本，返回 (exit_code, stdout, stderr)；会话断开时抛出 OSError"""
+        tok = self.token.decode()
+        with self.lock:
+            self.sock.sendall("( {}\n) </dev/null\n__rc=$?; printf '\\n%s\\n' {} >&2; printf '\\n%s %d\\n' {} $__rc\n".format(
+                script, tok, tok).encode())
+            out = err = b""
+            done_out = done_err = False
+            for stream, data in self.frames:
+                if stream == 2:
+                    err += data
+                    done_err = err.endswith(b"\n" + self.token + b"\n")
+                else:
+                    out += data
+                    done_out = out.rfind(b"\n" + self.token + b" ") >= 0 and out.endswith(b"\n")
+                if done_out and done_err:
+                    break
+            else:
+                raise OSError("exec session closed")
+        i = out.rfind(b"\n" + self.token + b" ")
+        return int(out[i:].split()[1]), out[:i], err[:-len(self.token) - 2]
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class container_table:
+    """由 docker events 维护的容器状态表：启动时拉取一次 /containers/json，之后只消费事件流"""
+    # docker events Action -> 容器状态
+    STATES = {
+        "create": "created",
+        "start": "running",
+        "restart": "running",
+        "unpause": "running",
+        "pause": "paused",
+        "die": "exited",
+    }
+
+    def __init__(self, sock_path=DOCKER_SOCK):
+        self.sock_path = sock_path
+        self._containers = {}  # name -> (state, created)
+        self._lock = threading.Lock()
+        self.ready = False
+        # 事件回调 fn(name, action)，在事件线程中调用
+        self.listeners = []
+
+    def start(self):
+        """加载初始状态并启动事件线程；Docker socket 不可用时返回 False（调用方回退到 docker CLI）"""
+        since = int(time.time())
+        try:
+            conn = unix_http_connection(self.sock_path, timeout=5)
+            conn.request("GET", "/containers/json?all=1")
+            resp = conn.getresponse()
+            if resp.status != 200:
+                return False
+            containers = json.loads(resp.read())
+            conn.close()
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            logging.debug("[*] Docker API unavailable, using docker CLI: %s", e)
+            return False
+
+        with self._lock:
+            for c in containers:
+                for n in c.get("Names", []):
+                    self._containers[n.lstrip('/')] = (c.get("State", ""), c.get("Created", 0))
+
+        # 从 bootstrap 之前的时间点订阅，避免遗漏中间发生的事件
+        filters = urllib.parse.quote(json.dumps({"type": ["container"]}))
+        try:
+            conn = unix_http_connection(self.sock_path)
+            conn.request("GET", "/events?since={}&filters={}".format(since, filters))
+            resp = conn.getresponse()
+            if resp.status != 200:
+                return False
+        except (OSError, http.client.HTTPException) as e:
+            logging.debug("[*] Docker events unavailable, using docker CLI: %s", e)
+            return False
+
+        self.ready = True
+        threading.Thread(target=self._watch, args=(conn, resp), daemon=True).start()
+        return True
+
+    def _watch(self, conn, resp):
+        try:
+            while True:
+                line = resp.readline()
+                if not line:
+                    break
+                try:
+                    self._apply(json.loads(line))
+                except ValueError:
+                    continue
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            # 事件流断开（如 dockerd 重启）：状态不再可信，回退到 docker CLI
+            self.ready = False
+            conn.close()
+
+    def _apply(self, event):
+        action = event.get("Action", "")
+        attrs = event.get("Actor", {}).get("Attributes", {})
+        name = attrs.get("name")
+        if not name:
+            return
+        with self._lock:
+            if action == "destroy":
+                self._containers.pop(name, None)
+            elif action == "rename":
+                old = self._containers.pop(attrs.get("oldName", "").lstrip('/'), None)
+                self._containers[name] = old or ("created", event.get("time", 0))
+            elif action in self.STATES:
+                created = self._containers.get(name, (None, event.get("time", 0)))[1]
+                self._containers[name] = (self.STATES[action], created)
+        for fn in self.listeners:
+            fn(name, action)
+
+    def snapshot(self):
+        """返回 [(name, state)]，按创建时间从旧到新排序"""
+        with self._lock:
+            items = sorted(self._containers.items(), key=lambda kv: kv[1][1])
+        return [(name, state) for name, (state, _) in items]
+
+    def state(self, name):
+        with self._lock:
+            entry = self._containers.get(name)
+        return entry[0] if entry else None
+
 
 class docker_helper:
     def __init__(self, firmae_root, remove_image=False, docker_image="fcore", auto_remove=False, with_dev=False, network_mode=None):
@@ -20,6 +434,18 @@ class docker_helper:
         self.count = 0
         self.last_core = None
         self.docker_image = docker_image
+        # 容器状态表（docker events 驱动），不可用时各方法回退到 docker CLI
+        self._table = container_table()
+        # 容器 IP 缓存：IP 在容器运行期间不变，收到 start/die/destroy/rename 事件时失效
+        self._ip_cache = {}
+        # 容器 -> exec_session，容器停止时关闭
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        # (容器, 固件名) -> IID；IID 在 scratch 目录中固定不变
+        self._iid_cache = {}
+        self._table.listeners.append(self._on_container_event)
+        self._table.start()
+        self._docker = docker_api()
         self.__sync_status()
         self.remove_image = remove_image
         # whether to run containers with --rm
@@ -29,127 +455,208 @@ class docker_helper:
         # docker network mode, e.g., 'host'
         self.network_mode = network_mode
 
+    def _on_container_event(self, name, action):
+        if action in ("start", "die", "stop", "destroy", "rename"):
+            self._ip_cache.pop(name, None)
+        if action in ("die", "destroy", "rename"):
+            self._drop_session(name)
+
+    def _api(self, method, path):
+        """调用 Docker Engine API；socket 不可用时返回 None，由调用方回退到 docker CLI"""
+        try:
+            return self._docker.request(method, path)
+        except _API_ERRORS as e:
+            logging.debug("[*] Docker API call %s %s failed, using docker CLI: %s", method, path, e)
+            return None
+
     def __sync_status(self):
         containers = self.get_container_list(with_pause=True)
         self.count = len(containers)
-        logging.debug("[*] current core : {}".format(self.count))
-
-    def get_container_list(self, with_pause=False, all_containers=False):
-        """获取容器列表，all_containers=True时包括停止的容器"""
+        logging.debug("[*] current core : %s", self.count)
+
+    def get_container_list(self, with_pause=False, all_containers=False, with_status=False):
+        """获取按创建时间从旧到新排列的容器名列表，all_containers=True时包括停止的容器；with_status=True时元素为 (name, state)。
+        Docker API 和 docker ps 都是从新到旧输出，要按从旧到新返回就必须先读完，所以这里不做流式产出"""
+        if self._table.ready:
+            return [(name, state) if with_status else name
+                    for name, state in self._table.snapshot()
+                    if (with_pause or state != "paused") and (state in ("running", "paused") or all_containers)]
+
+        api = self._api("GET", "/containers/json?all={}".format(1 if all_containers else 0))
+        if api is not None and api[0] == 200:
+            ret = []
+            for c in reversed(api[1]):
+                state = c.get("State", "")
+                if state == "paused" and not with_pause:
+                    continue
+                for n in c.get("Names", [])[:1]:
+                    ret.append((n.lstrip('/'), state) if with_status else n.lstrip('/'))
+            return ret
+
+        cmd = ["docker", "ps", "-a"] if all_containers else ["docker", "ps"]
+        # 仅输出名称和状态，避免解析列宽问题
+        cmd += ["--format", "{{.Names}} {{.Status}}"]
         try:
-            cmd = ["docker", "ps", "-a"] if all_containers else ["docker", "ps"]
-            # 仅输出名称，避免解析列宽问题
-            cmd += ["--format", "{{.Names}} {{.Status}}"]
             result = sp.run(cmd, capture_output=True, text=True)
             if result.returncode != 0:
-                logging.error("[-] Docker command failed: {}".format(result.stderr))
+                logging.error("[-] Docker command failed: %s", result.stderr)
                 return []
-            lines = [l for l in result.stdout.split('\n') if l.strip()]
-        except Exception as e:
-            logging.error("[-] Error getting container list: {}".format(e))
+        except OSError as e:
+            logging.error("[-] Error getting container list: %s", e)
             return []
-        
+
         ret = []
-        for line in lines:
+        for line in reversed(result.stdout.splitlines()):
+            line = line.strip()
+            if not line:
+                continue
             try:
                 name, status = line.split(' ', 1)
             except ValueError:
-                name, status = line.strip(), ''
+                name, status = line, ''
             if not with_pause and 'Paused' in status:
                 continue
-            if name:
-                ret.append(name)
-
-        return ret[::-1]
+            ret.append((name, _status_to_state(status)) if with_status else name)
+        return ret
+
+    def container_state(self, container_name):
+        """返回容器状态（running/paused/exited/created...），容器不存在时返回 None"""
+        if self._table.ready:
+            return self._table.state(container_name)
+        return self.inspect_state(container_name)
+
+    def inspect_state(self, container):
+        """直接向 Docker 查询容器（名称或 ID）的状态；一次 inspect 同时回答“是否存在”和“是否运行”"""
+        api = self._api("GET", "/containers/{}/json".format(urllib.parse.quote(container)))
+        if api is not None:
+            return api[1]["State"]["Status"] if api[0] == 200 else None
+        result = sp.run(["docker", "inspect", "-f", "{{.State.Status}}", container],
+                        stdout=sp.PIPE, stderr=sp.DEVNULL, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
 
     def check_existing_container(self, firmware):
         """检查是否已经存在该固件的容器（包括停止的）"""
-        import re
-        sanitized = firmware.replace('/', '_').replace(' ', '_').replace('.', '_')
         # 匹配 docker<number>_<sanitized_firmware>
-        pattern = re.compile(rf"^docker\d+_{re.escape(sanitized)}$")
-        
-        # 首先检查运行中的容器
-        containers = self.get_container_list()
-        for container in containers:
-            if pattern.match(container):
-                logging.info("[+] Found running container: {}".format(container))
+        pattern = _container_pattern(_sanitize(firmware))
+
+        # 一次获取所有容器（包括停止的），运行中的优先
+        stopped = None
+        for container, state in self.get_container_list(with_pause=True, all_containers=True, with_status=True):
+            if not pattern.match(container):
+                continue
+            if state == "running":
+                logging.info("[+] Found running container: %s", container)
                 return container, "running"
-        
-        # 检查所有容器（包括停止的）
-        all_containers = self.get_container_list(all_containers=True)
-        for container in all_containers:
-            if pattern.match(container):
-                logging.info("[+] Found stopped container: {}".format(container))
-                return container, "stopped"
-        
+            stopped = stopped or container
+
+        if stopped:
+            logging.info("[+] Found stopped container: %s", stopped)
+            return stopped, "stopped"
         return None, None
 
+    def wait_running(self, container_name, timeout=30):
+        """等待容器进入 running 状态（事件表实时更新，无需固定 sleep）"""
+        return _wait(lambda: self.container_state(container_name) == "running", timeout=timeout)
+
     def start_stopped_container(self, container_name):
         """启动已停止的容器"""
+        api = self._api("POST", "/containers/{}/start".format(urllib.parse.quote(container_name)))
+        if api is not None:
+            status, body = api
+            # 304: 容器已经在运行
+            if status in (204, 304) and self.wait_running(container_name):
+                logging.info("[+] Container %s started successfully", container_name)
+                return True
+            logging.error("[-] Failed to start container %s: %s", container_name, (body or {}).get("message", status))
+            return False
+
         try:
-            result = sp.run(["docker", "start", container_name], capture_output=True, text=True)
-            if result.returncode == 0:
-                logging.info("[+] Container {} started successfully".format(container_name))
+            result = sp.run(["docker", "start", container_name], stdout=sp.DEVNULL, stderr=sp.PIPE)
+            if result.returncode == 0 and self.wait_running(container_name):
+                logging.info("[+] Container %s started successfully", container_name)
                 return True
             else:
-                logging.error("[-] Failed to start container {}: {}".format(container_name, result.stderr))
+                logging.error("[-] Failed to start container %s: %s", container_name, result.stderr.decode('utf-8', 'replace').strip())
                 return False
         except Exception as e:
-            logging.error("[-] Exception starting container {}: {}".format(container_name, e))
+            logging.error("[-] Exception starting container %s: %s", container_name, e)
             return False
 
     def remove_container(self, container_name):
         """删除容器"""
+        api = self._api("DELETE", "/containers/{}?force=1".format(urllib.parse.quote(container_name)))
+        if api is not None:
+            status, body = api
+            if status == 204:
+                logging.info("[+] Container %s removed successfully", container_name)
+                return True
+            logging.error("[-] Failed to remove container %s: %s", container_name, (body or {}).get("message", status))
+            return False
+
         try:
-            result = sp.run(["docker", "rm", "-f", container_name], capture_output=True, text=True)
+            result = sp.run(["docker", "rm", "-f", container_name], stdout=sp.DEVNULL, stderr=sp.PIPE)
             if result.returncode == 0:
-                logging.info("[+] Container {} removed successfully".format(container_name))
+                logging.info("[+] Container %s removed successfully", container_name)
                 return True
             else:
-                logging.error("[-] Failed to remove container {}: {}".format(container_name, result.stderr))
+                logging.error("[-] Failed to remove container %s: %s", container_name, result.stderr.decode('utf-8', 'replace').strip())
                 return False
         except Exception as e:
-            logging.error("[-] Exception removing container {}: {}".format(container_name, e))
+            logging.error("[-] Exception removing container %s: %s", container_name, e)
             return False
 
     def get_container_ip(self, container_name):
-        """获取容器的IP地址"""
+        """获取容器的IP地址（仅在事件流可用、能及时失效时缓存）"""
+        ip = self._ip_cache.get(container_name)
+        if ip and self._table.ready:
+            return ip
+        ip = self._inspect_container_ip(container_name)
+        if ip and self._table.ready:
+            self._ip_cache[container_name] = ip
+        return ip
+
+    def _inspect_container_ip(self, container_name):
+        api = self._api("GET", "/containers/{}/json".format(urllib.parse.quote(container_name)))
+        if api is not None:
+            if api[0] != 200:
+                return None
+            networks = api[1].get("NetworkSettings", {}).get("Networks") or {}
+            return "".join(n.get("IPAddress", "") for n in networks.values())
+
         try:
             cmd = ["docker", "inspect", "-f", "{{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}", container_name]
             result = sp.run(cmd, capture_output=True, text=True)
             if result.returncode == 0:
                 return result.stdout.strip()
         except Exception as e:
-            logging.error("[-] Failed to get container IP: {}".format(e))
+            logging.error("[-] Failed to get container IP: %s", e)
         return None
 
-    def setup_network_access(self, container_name):
-        """设置网络访问，包括端口转发和路由"""
+    def setup_network_access(self, container_name, port_forwarding=True, route=True):
+        """设置网络访问，包括端口转发和路由；port_forwarding=False 时只设置路由（转发已由调用方完成），
+        route=False 时不改动宿主机上唯一的 192.168.0.1 路由"""
         container_ip = self.get_container_ip(container_name)
         if not container_ip:
             logging.error("[-] Could not get container IP")
             return
         
-        logging.info("[+] Container IP: {}".format(container_ip))
+        logging.info("[+] Container IP: %s", container_ip)
         
-        # 添加到固件设备的路由（假设固件IP是192.168.0.1）
-        try:
-            # 先删除可能存在的旧路由
-            sp.run(["sudo", "ip", "route", "del", "192.168.0.1/32"], capture_output=True)
-            
-            # 添加新路由
-            result = sp.run(["sudo", "ip", "route", "add", "192.168.0.1/32", "via", container_ip], 
-                          capture_output=True, text=True)
-            if result.returncode == 0:
-                logging.info("[+] Added route to firmware device: 192.168.0.1 via {}".format(container_ip))
-            else:
-                logging.warning("[!] Failed to add route: {}".format(result.stderr))
-        except Exception as e:
-            logging.error("[-] Exception setting up route: {}".format(e))
+        # 添加到固件设备的路由（假设固件IP是192.168.0.1）；replace 会原子地覆盖已存在的旧路由
+        if route:
+            try:
+                result = sp.run(["sudo", "ip", "route", "replace", "192.168.0.1/32", "via", container_ip],
+                              stdout=sp.DEVNULL, stderr=sp.PIPE)
+                if result.returncode == 0:
+                    logging.info("[+] Added route to firmware device: 192.168.0.1 via %s", container_ip)
+                else:
+                    logging.warning("[!] Failed to add route: %s", result.stderr.decode('utf-8', 'replace').strip())
+            except Exception as e:
+                logging.error("[-] Exception setting up route: %s", e)
         
         # 设置端口转发
-        self.setup_port_forwarding(container_name, container_ip)
+        if port_forwarding:
+            self.setup_port_forwarding(container_name, container_ip)
         
         # 显示访问信息
         logging.info("\n" + "="*60)
@@ -160,146 +667,73 @@ class docker_helper:
         logging.info("      - telnet 192.168.0.1")
         logging.info("    ")
         logging.info("    Via container IP:")
-        logging.info("      - http://{}:8080 (forwarded to 192.168.0.1:80)".format(container_ip))
-        logging.info("      - http://{}:8443 (forwarded to 192.168.0.1:443)".format(container_ip))
-        logging.info("      - telnet {} 2323 (forwarded to 192.168.0.1:23)".format(container_ip))
-        logging.info("      - gdb {} 11337 (forwarded to 192.168.0.1:1337)".format(container_ip))
+        logging.info("      - http://%s:8080 (forwarded to 192.168.0.1:80)", container_ip)
+        logging.info("      - http://%s:8443 (forwarded to 192.168.0.1:443)", container_ip)
+        logging.info("      - telnet %s 2323 (forwarded to 192.168.0.1:23)", container_ip)
+        logging.info("      - gdb %s 11337 (forwarded to 192.168.0.1:1337)", container_ip)
         logging.info("    ")
         logging.info("    Container shell access:")
-        logging.info("      - docker exec -it {} bash".format(container_name))
+        logging.info("      - docker exec -it %s bash", container_name)
         logging.info("="*60 + "\n")
 
     def setup_port_forwarding(self, container_name, container_ip):
         """在容器内设置端口转发"""
-        # 首先检查socat是否已安装
-        check_socat = ["docker", "exec", container_name, "which", "socat"]
-        result = sp.run(check_socat, capture_output=True)
-        
+        # 脚本走 stdin，避免 bash 自身的命令行被 pgrep -f 匹配到
+        try:
+            result = sp.run(["docker", "exec", "-i", container_name, "bash", "-s"],
+                            input=_port_forward_script(self.network_mode != "host"), capture_output=True, text=True)
+        except Exception as e:
+            logging.warning("[!] Exception setting up port forwarding: %s", e)
+            return
         if result.returncode != 0:
-            logging.info("[*] Installing socat in container...")
-            install_cmd = ["docker", "exec", container_name, "bash", "-c", 
-                          "apt-get update > /dev/null 2>&1 && apt-get install -y socat > /dev/null 2>&1"]
-            sp.run(install_cmd, capture_output=True)
-        
-        # 端口映射配置
-        port_mappings = [
-            (8080, 80, "HTTP"),
-            (8443, 443, "HTTPS"),
-            (2323, 23, "Telnet"),
-            (2222, 22, "SSH"),
-            (11337,1337,"GDB")
-        ]
-        
-        for listen_port, target_port, service in port_mappings:
-            # 先检查端口是否已经在转发
-            check_cmd = ["docker", "exec", container_name, "pgrep", "-f", "socat.*{}".format(listen_port)]
-            if sp.run(check_cmd, capture_output=True).returncode == 0:
-                logging.debug("[*] {} forwarding already running".format(service))
+            logging.warning("[!] Failed to setup port forwarding: %s", result.stderr)
+            return
+        self.log_port_forwarding(container_ip, result.stdout)
+
+    def log_port_forwarding(self, container_ip, output):
+        """解析转发脚本输出的 "SVC running|started" 行"""
+        ports = {svc: (l, t) for l, t, svc in PORT_MAPPINGS}
+        for line in output.splitlines():
+            if line == "installing":
+                logging.info("[*] Installing socat in container...")
                 continue
-            
-            forward_cmd = [
-                "docker", "exec", "-d", container_name,
-                "socat", 
-                "TCP-LISTEN:{},fork,reuseaddr".format(listen_port),
-                "TCP:192.168.0.1:{}".format(target_port)
-            ]
-            
-            try:
-                result = sp.run(forward_cmd, capture_output=True, text=True)
-                if result.returncode == 0:
-                    logging.debug("[+] {} forwarding: {}:{} -> 192.168.0.1:{}".format(
-                        service, container_ip, listen_port, target_port))
-                else:
-                    logging.warning("[!] Failed to setup {} forwarding: {}".format(service, result.stderr))
-            except Exception as e:
-                logging.warning("[!] Exception setting up {} forwarding: {}".format(service, e))
+            service, _, state = line.partition(' ')
+            if service not in ports:
+                continue
+            if state == "running":
+                logging.debug("[*] %s forwarding already running", service)
+            else:
+                logging.debug("[+] %s forwarding: %s:%s -> 192.168.0.1:%s",
+                              service, container_ip, ports[service][0], ports[service][1])
 
     def stop_core(self, container_name):
+        api = self._api("POST", "/containers/{}/stop".format(urllib.parse.quote(container_name)))
+        if api is not None:
+            status, body = api
+            # 304: 容器已经停止
+            if status in (204, 304):
+                logging.info("[+] Container %s stopped successfully", container_name)
+                return container_name
+            logging.error("[-] Failed to stop container %s: %s", container_name, (body or {}).get("message", status))
+            return None
+
         try:
-            result = sp.run("docker stop {}".format(container_name), shell=True, capture_output=True, text=True)
+            result = sp.run(["docker", "stop", container_name], stdout=sp.PIPE, stderr=sp.PIPE, text=True)
             if result.returncode == 0:
-                logging.info("[+] Container {} stopped successfully".format(container_name))
+                logging.info("[+] Container %s stopped successfully", container_name)
                 return result.stdout
             else:
-                logging.error("[-] Failed to stop container {}: {}".format(container_name, result.stderr))
+                logging.error("[-] Failed to stop container %s: %s", container_name, result.stderr)
         except Exception as e:
-            logging.error("[-] Exception stopping container {}: {}".format(container_name, e))
+            logging.error("[-] Exception stopping container %s: %s", container_name, e)
             return None
 
-    def run_core(self, idx, mode, brand, firmware_path):
-        firmware_root = os.path.dirname(firmware_path)
-        firmware = os.path.basename(firmware_path)
-        docker_name = 'docker{}_{}'.format(idx, firmware.replace('/', '_').replace(' ', '_').replace('.', '_'))
-        
-        # 首先检查容器是否已经存在（无论运行还是停止）
-        try:
-            # 检查容器是否存在
-            check_cmd = ["docker", "ps", "-a", "--filter", f"name={docker_name}", "--format", "{{.Names}}"]
-            result = sp.run(check_cmd, capture_output=True, text=True)
-            
-            if result.stdout.strip():
-                # 容器存在，检查状态
-                status_cmd = ["docker", "ps", "--filter", f"name={docker_name}", "--format", "{{.Names}}"]
-                status_result = sp.run(status_cmd, capture_output=True, text=True)
-                
-                if status_result.stdout.strip():
-                    # 容器正在运行
-                    logging.info("[+] Container {} is already running".format(docker_name))
-                    self.setup_network_access(docker_name)
-                    
-                    if mode == "-d":
-                        logging.info("[*] Attaching to existing container...")
-                        attach_cmd = ["docker", "exec", "-it", docker_name, "bash"]
-                        try:
-                            sp.run(attach_cmd)
-                        except KeyboardInterrupt:
-                            logging.info("[*] Detached from container")
-                    
-                    return docker_name
-                else:
-                    # 容器已停止
-                    logging.info("[*] Found stopped container: {}".format(docker_name))
-                    response = input("[?] Container exists but is stopped. (s)tart, (r)emove and recreate, or (q)uit? [s]: ").lower() or 's'
-                    
-                    if response == 's':
-                        if self.start_stopped_container(docker_name):
-                            time.sleep(5)
-                            self.setup_network_access(docker_name)
-                            
-                            if mode == "-d":
-                                attach_cmd = ["docker", "exec", "-it", docker_name, "bash"]
-                                try:
-                                    sp.run(attach_cmd)
-                                except KeyboardInterrupt:
-                                    logging.info("[*] Detached from container")
-                            
-                            return docker_name
-                    elif response == 'r':
-                        logging.info("[*] Removing existing container...")
-                        self.remove_container(docker_name)
-                        # 继续创建新容器
-                    else:
-                        logging.info("[*] Exiting...")
-                        return None
-                        
-        except Exception as e:
-            logging.error("[-] Error checking container existence: {}".format(e))
-        # 创建新容器
-        logging.info("[*] Starting new container {} for firmware {}".format(docker_name, firmware))
-        
-        # 检查Docker镜像是否存在
-        try:
-            result = sp.run("docker images -q {}".format(self.docker_image), shell=True, capture_output=True, text=True)
-            if not result.stdout.strip():
-                logging.error("[-] Docker image '{}' not found. Please build the image first.".format(self.docker_image))
-                return docker_name
-        except Exception as e:
-            logging.error("[-] Error checking docker image: {}".format(e))
-            return docker_name
-        
-        # 构建docker run命令（默认不使用 --rm，避免 stop 后容器被删除，便于 checkpoint/restore）
+    def docker_run_cmd(self, docker_name, firmware_root=None, tty=False):
+        """构建docker run命令；firmware_root 为 None 时不挂载固件目录（预热池容器）"""
+        # 默认不使用 --rm，避免 stop 后容器被删除，便于 checkpoint/restore。
+        # 镜像默认进程是 bash，需要 -i 保持 stdin 打开才不会立即退出；只有交互模式才分配 TTY
         cmd = [
-            "docker", "run", "-dit",
+            "docker", "run", "-dit" if tty else "-di",
         ]
 
         if self.auto_remove:
@@ -310,10 +744,7 @@ class docker_helper:
             cmd.extend(["--network", self.network_mode])
 
         # bind mounts and security options
-        cmd.extend([
-            "-v", "{}:/work/FirmAE".format(self.firmae_root),
-            "-v", "{}:/work/firmwares".format(firmware_root),
-        ])
+        cmd.extend(["-v", "{}:/work/FirmAE".format(self.firmae_root)])
 
         if self.with_dev:
             cmd.extend(["-v", "/dev:/dev"])
@@ -324,99 +755,330 @@ class docker_helper:
             # Relax seccomp to avoid unexpected denials during checkpoint
             "--security-opt", "seccomp=unconfined",
             "--privileged=true",
-            "--name", docker_name,
-            self.docker_image
         ])
 
-        logging.debug("[*] Docker command: {}".format(' '.join(cmd)))
+        # 与容器名、固件目录无关的配置摘要，预热池只把容器交给配置相同的调用
+        config = hashlib.sha1("\0".join(cmd + [self.docker_image]).encode()).hexdigest()[:16]
+        cmd.extend(["--label", "{}={}".format(POOL_CONFIG_LABEL, config)])
+        if firmware_root:
+            cmd.extend(["-v", "{}:/work/firmwares".format(firmware_root)])
+        cmd.extend(["--name", docker_name, self.docker_image])
+        return cmd
+
+    def pool_config(self):
+        """当前调用的 docker run 配置摘要（即 POOL_CONFIG_LABEL 标签的值）；预热容器都不分配 TTY"""
+        cmd = self.docker_run_cmd("")
+        return cmd[cmd.index("--label") + 1].split("=", 1)[1]
+
+    def create_container(self, docker_name, firmware_root, init_db=True, tty=False):
+        """创建并启动新容器；init_db=False 时由调用方在自己的 docker exec 里初始化 PostgreSQL"""
+        logging.info("[*] Starting new container %s", docker_name)
+
+        # 检查Docker镜像是否存在
+        try:
+            result = sp.run(["docker", "image", "inspect", self.docker_image], stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+            if result.returncode != 0:
+                logging.error("[-] Docker image '%s' not found. Please build the image first.", self.docker_image)
+                return False
+        except Exception as e:
+            logging.error("[-] Error checking docker image: %s", e)
+            return False
+        
+        cmd = self.docker_run_cmd(docker_name, firmware_root, tty=tty)
+        logging.debug("[*] Docker command: %s", ' '.join(cmd))
 
         try:
             result = sp.run(cmd, capture_output=True, text=True)
             if result.returncode != 0:
-                logging.error("[-] Failed to start container {}: {}".format(docker_name, result.stderr))
-                return docker_name
+                logging.error("[-] Failed to start container %s: %s", docker_name, result.stderr)
+                return False
             
-            logging.info("[+] Container {} started successfully".format(docker_name))
-            logging.debug("[*] Container ID: {}".format(result.stdout.strip()))
+            cid = result.stdout.strip()
+            logging.info("[+] Container %s started successfully", docker_name)
+            logging.debug("[*] Container ID: %s", cid)
             
         except Exception as e:
-            logging.error("[-] Exception starting container {}: {}".format(docker_name, e))
-            return docker_name
+            logging.error("[-] Exception starting container %s: %s", docker_name, e)
+            return False
+
+        # docker run -d 在容器启动后才返回，通常一次 inspect 即可确认；按 ID 查询，不依赖事件表是否已跟上
+        if not _wait(lambda: self.inspect_state(cid) == "running", timeout=10):
+            logging.error("[-] Container %s is not running after start", docker_name)
+            return False
+
+        if init_db:
+            self.init_postgres(docker_name)
+        return True
 
-        time.sleep(5)
+    def init_postgres(self, docker_name):
+        """初始化PostgreSQL"""
+        init_db_cmd = ["docker", "exec", docker_name, "bash", "-c", POSTGRES_INIT]
 
-        # 检查容器是否真的在运行
         try:
-            result = sp.run("docker ps --filter name={}".format(docker_name), shell=True, capture_output=True, text=True)
-            if docker_name not in result.stdout:
-                logging.error("[-] Container {} is not running after start".format(docker_name))
-                return docker_name
+            result = sp.run(init_db_cmd, stdout=sp.DEVNULL, stderr=sp.PIPE)
+            if result.returncode == 0:
+                logging.debug("[+] PostgreSQL initialized for %s", docker_name)
+            else:
+                logging.warning("[!] PostgreSQL initialization warning for %s: %s", docker_name, result.stderr.decode('utf-8', 'replace').strip())
         except Exception as e:
-            logging.error("[-] Error checking container status: {}".format(e))
+            logging.warning("[!] PostgreSQL initialization exception for %s: %s", docker_name, e)
+
+    def warm_pool(self, n):
+        """预先启动 n 个空闲容器（fcore_pool_<i>），后续 run_core 直接认领，省去 docker run 和数据库初始化"""
+        existing = set(self.get_container_list(with_pause=True, all_containers=True))
+        matching = set(self.pool_containers())
+        for i in range(n):
+            name = "{}{}".format(POOL_PREFIX, i)
+            if name in existing:
+                if name not in matching:
+                    logging.warning("[!] Pool container %s was created with a different configuration and will not be claimed", name)
+                continue
+            if self.create_container(name, None):
+                logging.info("[+] Pool container %s ready", name)
+
+    def pool_containers(self):
+        """运行中且配置标签与当前调用一致的预热池容器名"""
+        label = "{}={}".format(POOL_CONFIG_LABEL, self.pool_config())
+        api = self._api("GET", "/containers/json?filters={}".format(
+            urllib.parse.quote(json.dumps({"label": [label]}))))
+        if api is not None and api[0] == 200:
+            names = [c["Names"][0].lstrip('/') for c in api[1] if c.get("Names")]
+        else:
+            result = sp.run(["docker", "ps", "--filter", "label=" + label, "--format", "{{.Names}}"],
+                            stdout=sp.PIPE, stderr=sp.DEVNULL, text=True)
+            names = result.stdout.split() if result.returncode == 0 else []
+        return [n for n in names if n.startswith(POOL_PREFIX)]
+
+    def rename_container(self, container_name, new_name):
+        """重命名容器，成功返回 True；原名已不存在（被别人认领）或新名被占用时返回 False"""
+        api = self._api("POST", "/containers/{}/rename?name={}".format(
+            urllib.parse.quote(container_name), urllib.parse.quote(new_name)))
+        if api is not None:
+            return api[0] == 204
+        return sp.run(["docker", "rename", container_name, new_name], capture_output=True).returncode == 0
+
+    def copy_into(self, container_name, src, dest_dir):
+        """把宿主机文件 src 拷到容器的 dest_dir 目录下，成功返回 True"""
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            tar.add(src, arcname=os.path.basename(src))
+        try:
+            self._docker.put_archive(container_name, dest_dir, buf.getvalue())
+            return True
+        except _API_ERRORS as e:
+            logging.debug("[*] Docker API put_archive failed, using docker CLI: %s", e)
+        result = sp.run(["docker", "cp", src, "{}:{}/".format(container_name, dest_dir)],
+                        stdout=sp.DEVNULL, stderr=sp.PIPE)
+        if result.returncode != 0:
+            logging.warning("[!] Failed to copy %s into %s: %s", src, container_name,
+                            result.stderr.decode('utf-8', 'replace').strip())
+        return result.returncode == 0
+
+    def claim_pool_container(self, docker_name, firmware_path):
+        """认领一个与当前配置（--with-dev、--net=、--rm、firmae_root 等）相同的空闲预热容器：
+        重命名为 docker_name 并拷入固件；没有可用容器时返回 False"""
+        for name in self.pool_containers():
+            # 重命名是原子的，并发认领时失败的一方继续尝试下一个
+            if not self.rename_container(name, docker_name):
+                continue
+            if not self.copy_into(docker_name, firmware_path, "/work/firmwares"):
+                self.remove_container(docker_name)
+                return False
+            return True
+        return False
 
-        # 初始化PostgreSQL
-        init_db_cmd = [
-            "docker", "exec", docker_name, "bash", "-c",
-            "service postgresql start && sleep 2 && sudo -u postgres createdb firmware || true && sudo -u postgres psql -d firmware -c \"CREATE EXTENSION IF NOT EXISTS pgcrypto;\" || true"
-        ]
+    def attach(self, cmd):
+        """交互式进入容器。之后本进程已无事可做，直接用 docker 替换当前进程，省去一次 fork 和等待"""
+        try:
+            os.execvp(cmd[0], cmd)
+        except OSError as e:
+            logging.error("[-] Failed to attach: %s", e)
+
+    def run_core(self, idx, mode, brand, firmware_path):
+        firmware_root = os.path.dirname(firmware_path)
+        firmware = os.path.basename(firmware_path)
+        docker_name = 'docker{}_{}'.format(idx, _sanitize(firmware))
         
+        # 首先检查容器是否已经存在（无论运行还是停止）
         try:
-            result = sp.run(init_db_cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                logging.debug("[+] PostgreSQL initialized for {}".format(docker_name))
-            else:
-                logging.warning("[!] PostgreSQL initialization warning for {}: {}".format(docker_name, result.stderr))
+            state = self.container_state(docker_name)
+
+            if state is not None:
+                # 容器存在，检查状态
+                if state in ("running", "paused"):
+                    # 容器正在运行
+                    logging.info("[+] Container %s is already running", docker_name)
+                    self.setup_network_access(docker_name)
+                    
+                    if mode == "-d":
+                        logging.info("[*] Attaching to existing container...")
+                        self.attach(["docker", "exec", "-it", docker_name, "bash"])
+                    
+                    return docker_name
+                else:
+                    # 容器已停止
+                    logging.info("[*] Found stopped container: %s", docker_name)
+                    response = input("[?] Container exists but is stopped. (s)tart, (r)emove and recreate, or (q)uit? [s]: ").lower() or 's'
+                    
+                    if response == 's':
+                        if self.start_stopped_container(docker_name):
+                            self.setup_network_access(docker_name)
+                            
+                            if mode == "-d":
+                                self.attach(["docker", "exec", "-it", docker_name, "bash"])
+                            
+                            return docker_name
+                    elif response == 'r':
+                        logging.info("[*] Removing existing container...")
+                        self.remove_container(docker_name)
+                        # 继续创建新容器
+                    else:
+                        logging.info("[*] Exiting...")
+                        return None
+                        
         except Exception as e:
-            logging.warning("[!] PostgreSQL initialization exception for {}: {}".format(docker_name, e))
+            logging.error("[-] Error checking container existence: %s", e)
+        # 后台模式优先认领预热池中的空闲容器（已启动、PostgreSQL 已初始化），否则创建新容器；
+        # 预热容器没有 TTY，交互模式（-d）总是新建。后台模式下 PostgreSQL 初始化与端口转发、run.sh 合并到同一次 docker exec
+        init_db = False
+        if mode != "-d" and self.claim_pool_container(docker_name, firmware_path):
+            logging.info("[+] Using pre-warmed container %s for firmware %s", docker_name, firmware)
+        elif self.create_container(docker_name, firmware_root, init_db=(mode == "-d"), tty=(mode == "-d")):
+            init_db = mode != "-d"
+        else:
+            return docker_name
 
         # 执行分析命令
-        docker_mode = "-it" if mode == "-d" else "-id"
-        exec_cmd = [
-            "docker", "exec", docker_mode, docker_name, "bash", "-c",
-            "cd /work/FirmAE && ./run.sh {} {} /work/firmwares/{}".format(mode, brand, firmware)
-        ]
-
         if mode == "-d":
             # 交互模式
-            logging.info("[*] Starting interactive mode for {}".format(docker_name))
+            logging.info("[*] Starting interactive mode for %s", docker_name)
             
-            # 设置网络访问（等待一段时间让固件启动）
-            logging.info("[*] Waiting for firmware to start...")
-            time.sleep(10)
+            # 设置网络访问（固件由下面的 run.sh 启动，转发规则在连接时才生效，无需等待固件）
             self.setup_network_access(docker_name)
             
-            try:
-                sp.run(exec_cmd)
-            except KeyboardInterrupt:
-                logging.info("[*] Interactive mode interrupted")
+            self.attach([
+                "docker", "exec", "-it", docker_name, "bash", "-c",
+                "cd /work/FirmAE && ./run.sh {} {} /work/firmwares/{}".format(mode, brand, firmware)
+            ])
             return docker_name
         else:
-            # 后台模式
-            log_file = "/work/FirmAE/scratch/{}.log".format(firmware)
-            exec_cmd[-1] += " 2>&1 > {} &".format(log_file)
-            
+            # 后台模式：数据库初始化、端口转发和启动 run.sh 在一次 docker exec 中完成，参数经 -e 传入
+            script = "{ " + POSTGRES_INIT + "; } >/dev/null 2>&1\n" if init_db else ""
+            script += _port_forward_script(self.network_mode != "host")
+            script += ("cd /work/FirmAE && nohup ./run.sh \"$MODE\" \"$BRAND\" \"/work/firmwares/$FW\" "
+                       "> \"/work/FirmAE/scratch/$FW.log\" 2>&1 </dev/null &\n")
+            cmd = ["docker", "exec", "-i", "-e", "MODE=" + mode, "-e", "BRAND=" + brand, "-e", "FW=" + firmware,
+                   docker_name, "bash", "-s"]
             try:
-                result = sp.run(exec_cmd, capture_output=True, text=True)
+                result = sp.run(cmd, input=script, capture_output=True, text=True)
                 if result.returncode != 0:
-                    logging.error("[-] Failed to execute analysis in {}: {}".format(docker_name, result.stderr))
-                    
-                # 等待固件启动并设置网络
-                logging.info("[*] Waiting for firmware to start...")
-                time.sleep(20)
-                self.setup_network_access(docker_name)
-                
+                    logging.error("[-] Failed to execute analysis in %s: %s", docker_name, result.stderr)
+
+                # 路由在宿主机上设置；路由和转发规则都不依赖固件已启动，所以不等待固件
+                self.setup_network_access(docker_name, port_forwarding=False)
+                self.log_port_forwarding(self.get_container_ip(docker_name), result.stdout)
+                logging.info("[*] Firmware is starting in the background, log: scratch/%s.log", firmware)
+
             except Exception as e:
-                logging.error("[-] Exception executing analysis in {}: {}".format(docker_name, e))
+                logging.error("[-] Exception executing analysis in %s: %s", docker_name, e)
 
         return docker_name
 
+    def find_iid(self, container_name, name):
+        """在容器的 /work/FirmAE/scratch/*/name 中查找固件名对应的 IID；一次读出全部名称，在本地匹配"""
+        key = (container_name, name)
+        if key in self._iid_cache:
+            return self._iid_cache[key]
+        _, out, _ = self.exec_run(container_name, ["sh", "-c", "grep -H '' /work/FirmAE/scratch/*/name 2>/dev/null"])
+        for line in out.decode('utf-8', 'replace').splitlines():
+            path, _, value = line.partition(':')
+            if value.strip() == name:
+                iid = os.path.basename(os.path.dirname(path))
+                self._iid_cache[key] = iid
+                return iid
+        return None
+
+    def install_script(self, container_name, name, body):
+        """把脚本上传到容器的 SCRIPT_DIR 下（文件名见 _script_name），返回其路径；
+        调用方只在 exec 以 SCRIPT_MISSING 退出、即容器里还没有这个脚本时才调用"""
+        path = _script_path(name, body)
+        data = _script_tar(name, body)
+        try:
+            self._docker.put_archive(container_name, SCRIPT_DIR, data)
+        except _API_ERRORS as e:
+            logging.debug("[*] Docker API put_archive failed, using docker CLI: %s", e)
+            result = sp.run(["docker", "cp", "-", "{}:{}".format(container_name, SCRIPT_DIR)],
+                            input=data, stdout=sp.DEVNULL, stderr=sp.PIPE)
+            if result.returncode != 0:
+                logging.warning("[!] Failed to install %s into %s: %s", name, container_name,
+                                result.stderr.decode('utf-8', 'replace').strip())
+        return path
+
+    def session(self, container_name):
+        """返回容器的常驻 exec_session（按需创建）；Docker API 不可用时返回 None"""
+        with self._sessions_lock:
+            if container_name not in self._sessions:
+                try:
+                    self._sessions[container_name] = exec_session(self._docker, container_name)
+                except _API_ERRORS as e:
+                    logging.debug("[*] Exec session unavailable for %s: %s", container_name, e)
+                    return None
+            return self._sessions[container_name]
+
+    def _drop_session(self, container_name):
+        with self._sessions_lock:
+            session = self._sessions.pop(container_name, None)
+        if session:
+            session.close()
+
+    def exec_run(self, container_name, cmd, detach=False, stdout=True):
+        """在容器中执行 cmd（argv 列表），返回 (exit_code, stdout, stderr)，输出为未解码的 bytes，只在出错时才需要解码；
+        stdout=False 时丢弃 stdout（返回 b""）。前台命令走容器的常驻 exec_session，其次是单次 API exec，
+        都不可用时回退到 docker exec"""
+        if not detach:
+            session = self.session(container_name)
+            if session:
+                try:
+                    code, out, err = session.run(shlex.join(cmd))
+                    return code, (out if stdout else b""), err
+                except OSError as e:
+                    logging.debug("[*] Exec session for %s failed: %s", container_name, e)
+                    self._drop_session(container_name)
+        try:
+            return self._docker.exec_run(container_name, cmd, detach=detach, stdout=stdout)
+        except _API_ERRORS as e:
+            logging.debug("[*] Docker API exec failed, using docker CLI: %s", e)
+        argv = ["docker", "exec"] + (["-d"] if detach else []) + [container_name] + list(cmd)
+        result = sp.run(argv, stdin=sp.DEVNULL, stdout=sp.PIPE if stdout else sp.DEVNULL, stderr=sp.PIPE)
+        return result.returncode, result.stdout or b"", result.stderr
+
+    def follow(self, container_name, cmd):
+        """在容器中执行 cmd，逐行产出 stdout（bytes）；优先走 Docker API 的流式 exec，不可用时回退到 docker exec"""
+        try:
+            pending = b""
+            for stream, data in self._docker.exec_stream(container_name, cmd):
+                if stream == 2:
+                    continue
+                pending += data
+                *lines, pending = pending.split(b"\n")
+                for line in lines:
+                    yield line + b"\n"
+            if pending:
+                yield pending
+            return
+        except _API_ERRORS as e:
+            logging.debug("[*] Docker API exec failed, using docker CLI: %s", e)
+        with sp.Popen(["docker", "exec", container_name] + list(cmd), stdin=sp.DEVNULL, stdout=sp.PIPE) as p:
+            yield from p.stdout
+
     def run_command(self, core, cmd):
         result = '[-] failed'
         try:
-            result = sp.run('docker exec -it {} bash -c "{}"'.format(core, cmd), shell=True, capture_output=True, text=True)
+            # 不经过宿主机 shell，命令原样交给容器内的 bash（变量在容器内展开）
+            result = sp.run(["docker", "exec", core, "bash", "-c", cmd], stdin=sp.DEVNULL, capture_output=True, text=True)
             return result.stdout if result.returncode == 0 else result.stderr
         except Exception as e:
-            logging.error("[-] Failed to run command in {}: {}".format(core, e))
+            logging.error("[-] Failed to run command in %s: %s", core, e)
         return result
 
     def create_checkpoint(self, container_name, checkpoint_name="warm1", leave_running=True, checkpoint_dir=None):
@@ -432,7 +1094,7 @@ class docker_helper:
 
         # 预检：容器内是否存在 hugetlbfs 挂载（CRIU 不支持）
         try:
-            mnt = sp.run(["docker", "exec", container_name, "sh", "-lc", "grep -w 'hugetlbfs' /proc/mounts || true"], capture_output=True, text=True)
+            mnt = sp.run(["docker", "exec", container_name, "sh", "-c", "grep -w 'hugetlbfs' /proc/mounts || true"], capture_output=True, text=True)
             if mnt.returncode == 0 and mnt.stdout.strip():
                 logging.error("[-] Detected hugetlbfs mount inside container (e.g., /dev/hugepages). Restart this container with '--mount type=tmpfs,destination=/dev/hugepages' (already default when using this helper). Re-run the workload, then checkpoint again.")
                 return False
@@ -446,13 +1108,13 @@ class docker_helper:
             args.append("--leave-running")
         args.extend([container_name, checkpoint_name])
         try:
-            result = sp.run(args, capture_output=True, text=True)
+            result = sp.run(args, stdout=sp.DEVNULL, stderr=sp.PIPE)
             if result.returncode == 0:
-                logging.info("[+] Checkpoint '{}' created for {}".format(checkpoint_name, container_name))
+                logging.info("[+] Checkpoint '%s' created for %s", checkpoint_name, container_name)
                 return True
-            logging.error("[-] Failed to create checkpoint: {}".format(result.stderr.strip()))
+            logging.error("[-] Failed to create checkpoint: %s", result.stderr.decode('utf-8', 'replace').strip())
         except Exception as e:
-            logging.error("[-] Exception creating checkpoint: {}".format(e))
+            logging.error("[-] Exception creating checkpoint: %s", e)
         return False
 
     def restore_checkpoint(self, container_name, checkpoint_name="warm1"):
@@ -464,18 +1126,161 @@ class docker_helper:
             pass
 
         try:
-            result = sp.run(["docker", "start", "--checkpoint", checkpoint_name, container_name], capture_output=True, text=True)
+            result = sp.run(["docker", "start", "--checkpoint", checkpoint_name, container_name], stdout=sp.DEVNULL, stderr=sp.PIPE)
             if result.returncode == 0:
-                logging.info("[+] Container {} restored from checkpoint '{}'".format(container_name, checkpoint_name))
+                logging.info("[+] Container %s restored from checkpoint '%s'", container_name, checkpoint_name)
                 # 还原后重新设置路由/端口
-                time.sleep(2)
+                self.wait_running(container_name)
                 self.setup_network_access(container_name)
                 return True
-            logging.error("[-] Failed to restore checkpoint: {}".format(result.stderr.strip()))
+            logging.error("[-] Failed to restore checkpoint: %s", result.stderr.decode('utf-8', 'replace').strip())
         except Exception as e:
-            logging.error("[-] Exception restoring checkpoint: {}".format(e))
+            logging.error("[-] Exception restoring checkpoint: %s", e)
         return False
 
+def _split_stages(err):
+    """把带有 "::stage=<name>" 标记行的 stderr 拆成 {name: 文本}"""
+    stages = {}
+    name = None
+    for line in err.splitlines(True):
+        if line.startswith("::stage="):
+            name = line[len("::stage="):].strip()
+            stages[name] = ""
+        elif name:
+            stages[name] += line
+    return stages
+
+# Commands used by every reset, built once.
+# '[q]emu-system' keeps pkill/pgrep from matching the command line of the bash that runs them.
+# Stop QEMU and wait for it to exit (instead of a fixed sleep); the IID's umount.sh is appended per reset
+STOP_QEMU_SCRIPT = ("pkill -f '[q]emu-system'; "
+                    "for i in $(seq 50); do pgrep -f '[q]emu-system' >/dev/null || break; sleep 0.1; done; ")
+# Poll inside the container (one exec, 100 ms steps, 10 s max) rather than sleeping a fixed 5 s
+WAIT_QEMU_CMD = ("bash", "-c",
+                 "for i in $(seq 100); do pgrep -f '[q]emu-system' >/dev/null && exit 0; sleep 0.1; done; exit 1")
+
+# -reset 在后台线程里做 setup_network_access，同时最多 8 个，避免一次起过多 sudo/docker 进程
+_NETWORK_SETUP_SLOTS = threading.BoundedSemaphore(8)
+
+def _setup_network_in_background(dh, container, route=True):
+    """在单独的线程里执行 setup_network_access 并立即返回，异常记录到日志而不是被吞掉。
+    线程不是 daemon，进程退出前仍会等它完成"""
+    def run():
+        with _NETWORK_SETUP_SLOTS:
+            try:
+                dh.setup_network_access(container, route=route)
+            except Exception:
+                logging.exception("[-] Network setup failed for %s", container)
+
+    t = threading.Thread(target=run, name="netsetup-{}".format(container))
+    t.start()
+    return t
+
+async def reset_one(dh, firmware_path, use_clean=False, route=True):
+    """重置一个仿真设备：停止 QEMU、umount 镜像、按需还原干净镜像、重新启动 run.sh。
+    route=False 时不改动宿主机到 192.168.0.1 的路由。成功返回 (container, iid)，失败返回 None。
+    阻塞的 Docker 调用放到工作线程里执行，多个 reset 在同一个事件循环上交错进行"""
+    firmware = os.path.basename(firmware_path)
+    base_noext = firmware.rsplit('.', 1)[0]
+
+    container, status = await asyncio.to_thread(dh.check_existing_container, firmware)
+    if not container:
+        logging.error("[-] No container found for firmware: %s", firmware)
+        return None
+
+    # Ensure running
+    if status == 'stopped':
+        logging.info("[*] Starting stopped container %s", container)
+        if not await asyncio.to_thread(dh.start_stopped_container, container):
+            return None
+
+    # Find IID by matching scratch/*/name equals base_noext
+    iid = await asyncio.to_thread(dh.find_iid, container, base_noext)
+    if not iid:
+        logging.error("[-] Could not find IID for firmware base '%s' in container %s", base_noext, container)
+        return None
+    logging.info("[+] Reseting IID %s (firmware base %s) in %s", iid, base_noext, container)
+
+    # Everything below depends only on the IID, so build the argv tuples once up front
+    run_sh = f"/work/FirmAE/scratch/{iid}/run.sh"
+    reset_log = f"/work/FirmAE/scratch/{iid}/reset.log"
+    argv_stop = ("bash", "-c", f"{STOP_QEMU_SCRIPT}/work/FirmAE/scripts/umount.sh {iid} || true")
+    argv_run = ("bash", "-c", f"exec >{reset_log} 2>&1 </dev/null; exec {run_sh}")
+
+    # Stop QEMU, then umount; one exec through the Docker API
+    await asyncio.to_thread(dh.exec_run, container, argv_stop, stdout=False)
+
+    if use_clean:
+        # Restore the clean image and restart firmware in one exec; ::stage= markers on stderr
+        # tell the two halves apart, and a failed clean is only a warning, as before.
+        # The restore script is invoked by path; only when this exec finds it missing is it shipped
+        # into the container and the exec retried, so each container receives it once
+        make_clean = _script_path(CLEAN_SCRIPT, CLEAN_SCRIPT_BODY)
+        script = (f"echo ::stage=clean >&2; {make_clean} {iid} || echo ::failed >&2; "
+                  f"echo ::stage=run >&2; nohup {run_sh} >{reset_log} 2>&1 &")
+        guarded = f"[ -x {make_clean} ] || exit {SCRIPT_MISSING}; {script}"
+        code, _, err = await asyncio.to_thread(dh.exec_run, container, ["bash", "-c", guarded], stdout=False)
+        if code == SCRIPT_MISSING:
+            # if the upload fails too, the retry reports it as a failed clean
+            await asyncio.to_thread(dh.install_script, container, CLEAN_SCRIPT, CLEAN_SCRIPT_BODY)
+            code, _, err = await asyncio.to_thread(dh.exec_run, container, ["bash", "-c", script], stdout=False)
+        stages = _split_stages(err.decode('utf-8', 'replace'))
+        if "::failed" in stages.get("clean", ""):
+            logging.warning("[!] Failed to restore clean image: %s", stages["clean"].replace("::failed", "").strip())
+    else:
+        # Nothing to report back, so let dockerd start run.sh detached; bash sets up the redirection
+        # and then execs run.sh, leaving a single process instead of bash + nohup + run.sh
+        code, _, err = await asyncio.to_thread(dh.exec_run, container, argv_run, detach=True)
+        stages = {"run": err.decode('utf-8', 'replace')}
+    if code != 0:
+        logging.error("[-] Failed to restart run.sh: %s", stages.get("run", "").strip())
+        return None
+    # Host-side network setup (container IP, route, forwarding rules) does not need the guest,
+    # so it runs in the background while we wait for QEMU to come back up
+    _setup_network_in_background(dh, container, route)
+    logging.info("[+] Restarted firmware, waiting for QEMU to come up...")
+    code, _, _ = await asyncio.to_thread(dh.exec_run, container, WAIT_QEMU_CMD, stdout=False)
+    if code != 0:
+        logging.warning("[!] QEMU is not running yet, see /work/FirmAE/scratch/%s/reset.log", iid)
+    logging.info("[+] Reset complete. Tail logs with: docker exec -it %s bash -lc 'tail -f /work/FirmAE/scratch/%s/reset.log'", container, iid)
+    return container, iid
+
+async def reset_many(dh, firmware_paths, use_clean=False, limit=32):
+    """并发重置多个设备（各在自己的容器中），同时最多 limit 个。
+    宿主机只有一条 192.168.0.1/32 路由，所以只在重置单个设备时才改动它"""
+    sem = asyncio.Semaphore(limit)
+    route = len(firmware_paths) == 1
+    if not route:
+        logging.warning("[!] Resetting %d firmwares: the host route to 192.168.0.1 is left unchanged, "
+                        "reach each device through its container IP and forwarded ports", len(firmware_paths))
+
+    async def one(path):
+        async with sem:
+            return await reset_one(dh, path, use_clean, route)
+
+    return await asyncio.gather(*(one(p) for p in firmware_paths))
+
+def follow_logs(dh, targets):
+    """跟随 [(container, iid)] 的 reset.log 输出直到 Ctrl-C；多个容器时每行加上容器名前缀"""
+    lock = threading.Lock()
+
+    def follow(container, iid):
+        prefix = "[{}] ".format(container).encode() if len(targets) > 1 else b""
+        for line in dh.follow(container, ["tail", "-F", "/work/FirmAE/scratch/{}/reset.log".format(iid)]):
+            with lock:
+                sys.stdout.buffer.write(prefix + line)
+                sys.stdout.buffer.flush()
+
+    threads = [threading.Thread(target=follow, args=t, daemon=True) for t in targets]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)
+    except KeyboardInterrupt:
+        pass
+
 def print_usage(argv0):
     print("[*] Usage:")
     print("  {} -ec [brand] [firmware_path]    # Extract and emulate".format(argv0))
@@ -485,9 +1290,10 @@ def print_usage(argv0):
     print("  {} -d [brand] [firmware_path]     # Debug mode (same as -ed)".format(argv0))
     print("  {} -c [command]                   # Run command in all containers".format(argv0))
     print("  {} -s [script]                    # Run script in all containers".format(argv0))
+    print("  {} -pool [n]                      # Pre-start n idle containers for later runs to claim".format(argv0))
     print("  {} -ckc [firmware_path] [name]    # Create checkpoint for container (default name: warm1)".format(argv0))
     print("  {} -ckr [firmware_path] [name]    # Restore container from checkpoint (default name: warm1)".format(argv0))
-    print("  {} -reset [firmware_path] [clean] # Reset: kill QEMU, umount, restart run.sh (clean=use image.clean)".format(argv0))
+    print("  {} -reset [firmware_path ...] [clean] [--follow] # Reset: kill QEMU, umount, restart run.sh (clean=use image.clean, --follow=stream reset.log)".format(argv0))
     print("\n[Global options]\n  --rm                                # Auto-remove container on stop (default: keep)\n  --with-dev                          # Bind host /dev into container (required for some emulations)\n  --net=host                          # Use host network mode (may help checkpoint/restore)\n")
 
 def runner(args):
@@ -497,7 +1303,19 @@ def runner(args):
         if mode not in ["-d", "-r"]:  # 不在调试/运行模式时才自动停止
             dh.stop_core(docker_name)
     else:
-        logging.error("[-] Can't find firmware file: {}".format(firmware))
+        logging.error("[-] Can't find firmware file: %s", firmware)
+
+def run_in_containers(dh, cmd):
+    """在所有运行中的容器里并发执行命令，按容器顺序输出结果"""
+    containers = dh.get_container_list()
+    if not containers:
+        logging.info("[*] No running containers found")
+        return
+    with ThreadPoolExecutor(max_workers=min(32, len(containers))) as ex:
+        results = list(ex.map(lambda core: dh.run_command(core, cmd), containers))
+    for core, output in zip(containers, results):
+        print(core)
+        print(output)
 
 def main():
     if len(sys.argv) < 2:
@@ -543,7 +1361,7 @@ def main():
             argv = (0, dh, "-d", brand, firmware_path)
             runner(argv)
         else:
-            logging.error("[-] Firmware file not found: {}".format(firmware_path))
+            logging.error("[-] Firmware file not found: %s", firmware_path)
 
     elif sys.argv[1] in ['-ec', '-ea']:
         if len(sys.argv) < 4:
@@ -561,7 +1379,7 @@ def main():
             argv = (0, dh, mode, brand, firmware_path)
             runner(argv)
         else:
-            logging.error("[-] Invalid firmware path: {}".format(firmware_path))
+            logging.error("[-] Invalid firmware path: %s", firmware_path)
 
     elif sys.argv[1] in ['-er', '-ed']:
         if len(sys.argv) < 3:
@@ -574,7 +1392,7 @@ def main():
             argv = (0, dh, mode, "auto", firmware_path)
             runner(argv)
         else:
-            logging.error("[-] Firmware file not found: {}".format(firmware_path))
+            logging.error("[-] Firmware file not found: %s", firmware_path)
 
     elif sys.argv[1] == '-c':
         if len(sys.argv) != 3:
@@ -582,12 +1400,26 @@ def main():
             exit(1)
 
         cmd = sys.argv[2]
-        containers = dh.get_container_list()
-        if not containers:
-            logging.info("[*] No running containers found")
-        for core in containers:
-            print(core)
-            print(dh.run_command(core, cmd))
+        run_in_containers(dh, cmd)
+
+    elif sys.argv[1] == '-s':
+        if len(sys.argv) != 3:
+            print_usage(sys.argv[0])
+            exit(1)
+
+        script_path = sys.argv[2]
+        if not os.path.isfile(script_path):
+            logging.error("[-] Script file not found: %s", script_path)
+            exit(1)
+        with open(script_path) as f:
+            run_in_containers(dh, f.read())
+
+    elif sys.argv[1] == '-pool':
+        if len(sys.argv) != 3 or not sys.argv[2].isdigit():
+            print_usage(sys.argv[0])
+            exit(1)
+
+        dh.warm_pool(int(sys.argv[2]))
 
     elif sys.argv[1] == '-ckc':
         # Create checkpoint for a container corresponding to the firmware file
@@ -601,14 +1433,13 @@ def main():
 
         container, status = dh.check_existing_container(firmware)
         if not container:
-            logging.error("[-] No container found for firmware: {}".format(firmware))
+            logging.error("[-] No container found for firmware: %s", firmware)
             exit(1)
 
         if status == 'stopped':
             logging.info("[*] Container is stopped. Starting before checkpoint...")
             if not dh.start_stopped_container(container):
                 exit(1)
-            time.sleep(5)
 
         if not dh.create_checkpoint(container, checkpoint_name=checkpoint_name):
             exit(1)
@@ -625,82 +1456,32 @@ def main():
 
         container, status = dh.check_existing_container(firmware)
         if not container:
-            logging.error("[-] No container found for firmware: {}".format(firmware))
+            logging.error("[-] No container found for firmware: %s", firmware)
             exit(1)
 
         if not dh.restore_checkpoint(container, checkpoint_name=checkpoint_name):
             exit(1)
 
     elif sys.argv[1] == '-reset':
-        # Reset emulated device: stop QEMU, umount image, optionally restore clean image, restart run.sh
+        # Reset emulated devices; several firmwares are reset concurrently since each lives in its own container
         if len(sys.argv) < 3:
             print_usage(sys.argv[0])
             exit(1)
 
-        firmware_path = os.path.abspath(sys.argv[2])
+        args = [a for a in sys.argv[2:] if a != '--follow']
+        follow = len(args) != len(sys.argv) - 2
+        # 末尾的布尔参数（与旧版 argv[3] 相同的取值）是 clean 开关，其余都是固件路径
+        truthy, falsy = ("clean", "true", "1", "yes", "y"), ("false", "0", "no", "n")
         use_clean = False
-        if len(sys.argv) >= 4:
-            use_clean = sys.argv[3].lower() in ("clean", "true", "1", "yes", "y")
-
-        firmware = os.path.basename(firmware_path)
-        base_noext = firmware.rsplit('.', 1)[0]
-
-        container, status = dh.check_existing_container(firmware)
-        if not container:
-            logging.error("[-] No container found for firmware: {}".format(firmware))
-            exit(1)
-
-        # Ensure running
-        if status == 'stopped':
-            logging.info("[*] Starting stopped container {}".format(container))
-            if not dh.start_stopped_container(container):
-                exit(1)
-            time.sleep(3)
-
-        # Find IID by matching scratch/*/name equals base_noext
-        find_iid_cmd = (
-            "bash -lc 'set -e; for d in /work/FirmAE/scratch/*; do "
-            "[ -f \"$d/name\" ] || continue; n=$(cat \"$d/name\"); "
-            f"if [ \"$n\" = \"{base_noext}\" ]; then basename \"$d\"; exit 0; fi; done; exit 1'"
-        )
-        iid_proc = sp.run(["docker", "exec", container, "bash", "-lc",
-                           f"for d in /work/FirmAE/scratch/*; do [ -f \"$d/name\" ] || continue; n=$(cat \"$d/name\"); if [ \"$n\" = \"{base_noext}\" ]; then basename \"$d\"; exit 0; fi; done; exit 1"],
-                          capture_output=True, text=True)
-        if iid_proc.returncode != 0:
-            logging.error("[-] Could not find IID for firmware base '{}' in container {}".format(base_noext, container))
-            exit(1)
-        iid = iid_proc.stdout.strip().splitlines()[0]
-        logging.info("[+] Reseting IID {} (firmware base {}) in {}".format(iid, base_noext, container))
-
-        # Stop QEMU, umount
-        sp.run(["docker", "exec", container, "bash", "-lc", "pkill -f qemu-system || true"], capture_output=True)
-        time.sleep(1)
-        sp.run(["docker", "exec", container, "bash", "-lc", f"/work/FirmAE/scripts/umount.sh {iid} || true"], capture_output=True)
-
-        if use_clean:
-            # Restore from clean baseline if present; if not present, create it now from current image.raw
-            make_clean = (
-                f"set -e; sd=/work/FirmAE/scratch/{iid}; "
-                f"if [ ! -f \"$sd/image.clean\" ]; then cp --reflink=auto --sparse=always \"$sd/image.raw\" \"$sd/image.clean\"; fi; "
-                f"cp --reflink=auto --sparse=always \"$sd/image.clean\" \"$sd/image.raw\""
-            )
-            r = sp.run(["docker", "exec", container, "bash", "-lc", make_clean], capture_output=True, text=True)
-            if r.returncode != 0:
-                logging.warning("[!] Failed to restore clean image: {}".format(r.stderr.strip()))
-
-        # Restart firmware (background)
-        runcmd = f"nohup /work/FirmAE/scratch/{iid}/run.sh >/work/FirmAE/scratch/{iid}/reset.log 2>&1 &"
-        r = sp.run(["docker", "exec", container, "bash", "-lc", runcmd], capture_output=True, text=True)
-        if r.returncode != 0:
-            logging.error("[-] Failed to restart run.sh: {}".format(r.stderr.strip()))
+        if len(args) >= 2 and args[-1].lower() in truthy + falsy:
+            use_clean = args.pop().lower() in truthy
+        firmware_paths = [os.path.abspath(a) for a in args]
+
+        results = asyncio.run(reset_many(dh, firmware_paths, use_clean))
+        if follow:
+            follow_logs(dh, [r for r in results if r])
+        if not all(results):
             exit(1)
-        logging.info("[+] Restarted firmware, waiting briefly...")
-        time.sleep(5)
-        try:
-            dh.setup_network_access(container)
-        except Exception:
-            pass
-        logging.info("[+] Reset complete. Tail logs with: docker exec -it {} bash -lc 'tail -f /work/FirmAE/scratch/{}/reset.log'".format(container, iid))
 
 if __name__ == "__main__":
     main()